@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+# longest-prefix-match IP to ASN lookups over the output of convert_rib.py,
+# either the text ipasndat file or the --bin IPASNBIN file.
+#
+# the (possibly nested) prefixes are flattened once into disjoint address
+# ranges: bounds[i] is the first address of range i and asns[i] its origin
+# (0 when no prefix covers it). a lookup is then one binary search. an
+# IPASNBIN file already holds the ranges and is searched in its mmap.
+#
+#   t = asnlookup.AsnLookup.load('ipasndat')
+#   t.lookup('8.8.8.8')                  -> 15169 (None when unrouted)
+#   t.lookup_many(ips)                   -> asns, 0 when unrouted
+#
+# lookup_many() uses numpy.searchsorted when numpy is installed.
+
+import bisect
+import sys
+
+import ipasndat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AsnLookup:
+
+    # entries: iterable of (start, mask, asn) integer tuples
+    def __init__(self, entries):
+        self.bounds, self.asns = ipasndat.flatten(entries)
+        self._np = None
+
+    # loads a text ipasndat file, or an IPASNBIN file used in place as a
+    # MappedLookup
+    @classmethod
+    def load(cls, path):
+        if is_bin(path):
+            return MappedLookup(ipasndat.BinTable(path))
+        return cls(read_text(path))
+
+    def __len__(self):
+        return len(self.bounds)
+
+    # ip: dotted quad or integer; returns the origin asn or None
+    def lookup(self, ip):
+        if not isinstance(ip, (int, long)):
+            ip = ipasndat.ip_to_int(ip)
+        asn = self.asns[bisect.bisect_right(self.bounds, ip) - 1]
+        return asn or None
+
+    # ips: iterable of dotted quads or integers, or a numpy integer array.
+    # returns the origin asns in the same order, 0 for unrouted addresses;
+    # a numpy uint32 array when numpy is available, else a list
+    def lookup_many(self, ips):
+        if numpy is None:
+            bounds, asns = self.bounds, self.asns
+            bisect_right, ip_to_int = bisect.bisect_right, ipasndat.ip_to_int
+            return [asns[bisect_right(bounds, ip if isinstance(ip, (int, long)) else ip_to_int(ip)) - 1]
+                    for ip in ips]
+
+        if self._np is None:
+            self._np = (numpy.frombuffer(self.bounds, dtype=numpy.uint32),
+                        numpy.frombuffer(self.asns, dtype=numpy.uint32))
+        bounds, asns = self._np
+
+        if not isinstance(ips, numpy.ndarray):
+            ips = numpy.array([ip if isinstance(ip, (int, long)) else ipasndat.ip_to_int(ip) for ip in ips],
+                              dtype=numpy.uint32)
+        return asns[numpy.searchsorted(bounds, ips, side='right') - 1]
+
+    def __str__(self):
+        return 'AsnLookup{ranges:%d}' % len(self.bounds)
+
+    def __repr__(self):
+        return str(self)
+
+
+
+# lookups straight out of the mmap of an IPASNBIN file, through its
+# flattened ranges: nothing is copied or parsed at load time
+class MappedLookup:
+
+    # t: an ipasndat.BinTable
+    def __init__(self, t):
+        self.table = t
+        self._np = None
+
+    def __len__(self):
+        return self.table.ranges
+
+    def lookup(self, ip):
+        if not isinstance(ip, (int, long)):
+            ip = ipasndat.ip_to_int(ip)
+        i = self.table.match_index(ip)
+        return (self.table.asn(i) or None) if i >= 0 else None
+
+    # as AsnLookup.lookup_many(); the numpy arrays are views of the mmap
+    def lookup_many(self, ips):
+        t = self.table
+        if numpy is None:
+            return [self.lookup(ip) or 0 for ip in ips]
+
+        if self._np is None:
+            self._np = (numpy.frombuffer(t.mm, '<u4', t.ranges, t.bounds_off),
+                        numpy.frombuffer(t.mm, '<u4', t.ranges, t.entries_off),
+                        numpy.frombuffer(t.mm, '<u4', t.count, t.asns_off))
+        bounds, entries, asns = self._np
+
+        if not isinstance(ips, numpy.ndarray):
+            ips = numpy.array([ip if isinstance(ip, (int, long)) else ipasndat.ip_to_int(ip) for ip in ips],
+                              dtype=numpy.uint32)
+        e = entries[numpy.searchsorted(bounds, ips, side='right') - 1]
+        if not t.count:
+            return numpy.zeros(len(e), dtype=numpy.uint32)
+        # e - 1 is -1 (the last asn) for unrouted addresses, masked to 0
+        return numpy.where(e > 0, asns[e.astype(numpy.int64) - 1], 0).astype(numpy.uint32)
+
+    def close(self):
+        self._np = None
+        self.table.close()
+
+    def __str__(self):
+        return 'MappedLookup{ranges:%d}' % self.table.ranges
+
+    def __repr__(self):
+        return str(self)
+
+
+
+# whether path is a binary IPASNBIN file rather than a text ipasndat file
+def is_bin(path):
+    f = open(path, 'rb')
+    try:
+        return f.read(len(ipasndat.MAGIC)) == ipasndat.MAGIC
+    finally:
+        f.close()
+
+
+# (start, mask, asn) for every line of a text ipasndat file
+def read_text(path):
+    for line in open(path):
+        if line.startswith(';'):
+            continue
+        cidr, asn = line.split('\t')
+        cidr, mask = cidr.split('/')
+        yield ipasndat.ip_to_int(cidr), int(mask), int(asn)
+
+
+# (start, mask, asn) for every entry of a text ipasndat or binary IPASNBIN file
+def read_entries(path):
+    if not is_bin(path):
+        return list(read_text(path))
+
+    t = ipasndat.BinTable(path)
+    try:
+        return [t[i] for i in xrange(len(t))]
+    finally:
+        t.close()
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print '\nUsage:  asnlookup.py   <ipasndat_file>   <ip> [<ip> ...]'
+        sys.exit()
+
+    t = AsnLookup.load(sys.argv[1])
+    for ip in sys.argv[2:]:
+        print '%s\t%s' % (ip, t.lookup(ip) or 'NA')
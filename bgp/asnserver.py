@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+# local IP to ASN whois server over a convert_rib.py table, answering the
+# Team Cymru whois protocol (http://www.team-cymru.org/Services/ip-to-asn.html)
+# so networking/cymru.py and other whois clients can query it instead of
+# whois.cymru.com. the table is loaded once and shared by every connection.
+#
+#   one query per connection:     [-v] [-p] <ip>
+#   bulk:                         begin / options and ips, one per line / end
+#   bulk options:                 verbose noverbose  header noheader
+#                                 asname noasname    prefix noprefix
+#
+# the table has no country, registry or allocation data, so those verbose
+# columns are left empty; AS names come from --asnames, a file of
+# "<asn> <name>" lines (such as ftp.ripe.net/ripe/asnames/asn.txt).
+#
+# the table file is checked every --reload seconds (and on SIGHUP); when a new
+# conversion has landed it is loaded in the background and swapped in, so
+# queries never wait for a reload.
+#
+# python 2 has no asyncio: connections are served by SocketServer threads,
+# which only read the shared index.
+
+import argparse
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+import asnlookup
+import ipasndat
+
+
+
+# an ipasndat table ready for longest-prefix matching. an IPASNBIN file is
+# searched in place through its mmap (ipasndat.BinTable.match()); for a text
+# file the flattened ranges of asnlookup.AsnLookup are built over entry
+# numbers instead of asns, so a lookup also yields the matching prefix.
+class Index:
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.lookup_table = None
+
+        if asnlookup.is_bin(path):
+            self.entries = ipasndat.BinTable(path)
+            return
+
+        entries = list(asnlookup.read_text(path))
+        self.entries = entries
+        self.lookup_table = asnlookup.AsnLookup((start, mask, i + 1) for i, (start, mask, asn) in enumerate(entries))
+
+    # (start, mask, asn) of the longest prefix covering ip (an int), or None
+    def match(self, ip):
+        if self.lookup_table is None:
+            return self.entries.match(ip)
+        i = self.lookup_table.lookup(ip)
+        return self.entries[i - 1] if i else None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+
+# {asn: name} of a "<asn> <name>" file
+def read_asnames(path):
+    d = {}
+    for line in open(path):
+        asn, _, name = line.strip().partition(' ')
+        if asn.upper().startswith('AS'):
+            asn = asn[2:]
+        if asn.isdigit():
+            d[int(asn)] = name.strip()
+    return d
+
+
+
+class WhoisServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, addr, table_file, asnames_file=None):
+        self.table_file = table_file
+        self.asnames_file = asnames_file
+        self.index = Index(table_file)
+        self.asnames = read_asnames(asnames_file) if asnames_file else {}
+        self.reload_lock = threading.Lock()
+        SocketServer.TCPServer.__init__(self, addr, WhoisHandler)
+
+    # loads the table again if its file changed; the new index replaces the
+    # old one in a single assignment, queries in flight finish on the old one
+    def reload(self, force=False):
+        if not self.reload_lock.acquire(False):
+            return False  # already reloading
+        try:
+            if not force and os.path.getmtime(self.table_file) == self.index.mtime:
+                return False
+            st = time.time()
+            index = Index(self.table_file)
+            if self.asnames_file:
+                self.asnames = read_asnames(self.asnames_file)
+            self.index = index
+            log('Reloaded %s (%d CIDRs) in %.1fs' % (self.table_file, len(index), time.time()-st))
+            return True
+        except Exception, e:
+            log('Reload of %s failed, keeping the old table: %s' % (self.table_file, e))
+            return False
+        finally:
+            self.reload_lock.release()
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+
+
+class WhoisHandler(SocketServer.StreamRequestHandler):
+
+    timeout = 60        # idle clients
+    wbufsize = 1 << 16  # written out when the query is answered
+
+    HEADER = ['AS', 'IP', 'BGP Prefix', 'CC', 'Registry', 'Allocated', 'AS Name']
+    WIDTHS = [7, 16, 19, 2, 8, 10, 0]
+
+    def handle(self):
+        line = self.rfile.readline(1024).strip()
+        if line.lower() == 'begin':
+            self.bulk()
+            return
+
+        # single query: flags then the ip
+        opts = {'verbose': False, 'prefix': False, 'asname': True, 'header': True}
+        words = line.split()
+        for w in words[:-1]:
+            if w == '-v':
+                opts['verbose'] = True
+            elif w == '-p':
+                opts['prefix'] = True
+        index = self.server.index
+        self.wfile.write(self.header(opts))
+        self.wfile.write(self.answer(index, words[-1] if words else '', opts, 1))
+
+    def bulk(self):
+        index = self.server.index  # one table for the whole session
+        opts = {'verbose': False, 'prefix': False, 'asname': True, 'header': False}
+        self.wfile.write('Bulk mode; whois.cymru.com [%s]\n' % time.strftime('%Y-%m-%d %H:%M:%S +0000', time.gmtime(index.mtime)))
+
+        n = 0
+        for line in self.rfile:
+            q = line.strip()
+            if not q or q.startswith('#'):
+                continue
+            word = q.lower()
+            if word == 'end':
+                break
+            if word.startswith('no') and word[2:] in opts:
+                opts[word[2:]] = False
+            elif word in opts:
+                opts[word] = True
+                if word == 'header':
+                    self.wfile.write(self.header(opts))
+            else:
+                n += 1
+                self.wfile.write(self.answer(index, q, opts, n))
+
+    def columns(self, opts):
+        if opts['verbose']:
+            cols = [0, 1, 2, 3, 4, 5]
+        elif opts['prefix']:
+            cols = [0, 1, 2]
+        else:
+            cols = [0, 1]
+        if opts['asname'] or opts['verbose']:
+            cols.append(6)
+        return cols
+
+    def header(self, opts):
+        return self.format(self.HEADER, opts)
+
+    # the columns of row selected by opts, padded as whois.cymru.com does
+    def format(self, row, opts):
+        return ' | '.join(row[c].ljust(self.WIDTHS[c]) for c in self.columns(opts)).rstrip() + '\n'
+
+    def answer(self, index, q, opts, n):
+        try:
+            ip = ipasndat.ip_to_int(q)
+        except (socket.error, UnicodeError):
+            return 'Error: no ASN or IP match on line %d.\n' % n
+
+        m = index.match(ip)
+        if m is None:
+            row = ['NA', q, 'NA', '', '', '', 'NA']
+        else:
+            start, mask, asn = m
+            row = [str(asn), q, '%s/%d' % (ipasndat.int_to_ip(start), mask), '', '', '',
+                   self.server.asnames.get(asn, 'NA')]
+        return self.format(row, opts)
+
+
+
+def log(s):
+    sys.stderr.write('%s %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), s))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='asnserver.py  [-b ADDR]  [-p PORT]  [--asnames FILE]  [--reload SECS]   <ipasndat_file>'
+    )
+    parser.add_argument('table_file', help='text ipasndat or IPASNBIN file from convert_rib.py')
+    parser.add_argument('-b', '--bind', default='127.0.0.1', metavar='ADDR')
+    parser.add_argument('-p', '--port', type=int, default=4343)
+    parser.add_argument('--asnames', metavar='FILE',
+        help='"<asn> <name>" lines for the AS Name column')
+    parser.add_argument('--reload', type=float, default=30, metavar='SECS',
+        help='check the table file for a new conversion this often (0 = only on SIGHUP)')
+    args = parser.parse_args()
+
+    st = time.time()
+    server = WhoisServer((args.bind, args.port), args.table_file, args.asnames)
+    log('Loaded %s (%d CIDRs) in %.1fs, listening on %s:%d' % (args.table_file, len(server.index), time.time()-st, args.bind, args.port))
+
+    if args.reload > 0:
+        t = threading.Thread(target=server.watch, args=(args.reload,))
+        t.daemon = True
+        t.start()
+
+    # reload in a thread, the signal handler runs inside serve_forever()
+    signal.signal(signal.SIGHUP, lambda sig, frame: threading.Thread(target=server.reload, args=(True,)).start())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
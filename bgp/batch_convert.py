@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+# converts many RIB dumps with convert_rib.py in one run, e.g. a backfill of
+# months of routeviews rib.YYYYMMDD.HHMM.bz2 files.
+#
+# inputs are files, directories (every file in them matching --pattern) or
+# glob patterns. files are converted concurrently, each in a worker process
+# of its own, and a new file is only started while the estimated memory of
+# the running ones stays within --memory. a file's estimate is its compressed
+# size times the highest peak RSS per compressed byte seen so far in this run
+# (--file-memory until the first file finishes). a worker that dies, such as
+# one killed by the OOM killer, is recorded as failed.
+#
+# every input is known by its path relative to --root (default: the deepest
+# directory holding all the inputs), so same-named dumps of different
+# collectors stay apart; two inputs that would share a name or outputs are an
+# error. outputs go to that relative path under OUT_DIR, without the
+# compression suffix:
+#   rib.20091125.0600.ipasndat        always
+#   rib.20091125.0600.ipasnbin        --bin
+#   rib.20091125.0600.ipv6.ipasndat   --ipv6
+#   rib.20091125.0600.moas            --moas
+# e.g. route-views2/bgpdata/2009.11/RIBS/rib.20091125.0600.ipasndat when
+# converting the dumps of several collectors at once.
+#
+# OUT_DIR/manifest.json records the result of every file by that relative
+# path (counts, timings, peak RSS, or the error). a file is skipped as up to date when all of its
+# outputs exist, are newer than it, and the manifest shows it was converted
+# from the same input size and mtime with the same options; so re-running a
+# backfill only converts new, changed or failed files.
+
+import argparse
+import fnmatch
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+
+import convert_rib
+
+
+MANIFEST = 'manifest.json'
+COMPRESSED = ('.bz2', '.gz', '.xz')
+
+# conversion options that change the output, recorded in the manifest
+OPTIONS = ['bin', 'aggregate', 'ipv6', 'majority', 'moas']
+
+
+
+# input files named by args (files, directories, glob patterns), sorted
+def find_inputs(args, pattern):
+    l = set()
+    for arg in args:
+        if os.path.isdir(arg):
+            for name in os.listdir(arg):
+                path = os.path.join(arg, name)
+                if fnmatch.fnmatch(name, pattern) and os.path.isfile(path):
+                    l.add(os.path.abspath(path))
+        elif os.path.isfile(arg):
+            l.add(os.path.abspath(arg))
+        else:
+            l.update(os.path.abspath(p) for p in glob.glob(arg) if os.path.isfile(p))
+    return sorted(l)
+
+
+# deepest directory holding all of paths (absolute)
+def common_dir(paths):
+    common = None
+    for path in paths:
+        parts = os.path.dirname(path).split(os.sep)
+        if common is None:
+            common = parts
+        else:
+            n = 0
+            while n < min(len(common), len(parts)) and common[n] == parts[n]:
+                n += 1
+            common = common[:n]
+    return os.sep.join(common or []) or os.sep
+
+
+# {kind: path} of the outputs of the input known as key (see main())
+def output_files(key, out_dir, opts):
+    base = key
+    for ext in COMPRESSED:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    base = os.path.join(out_dir, base)
+
+    d = {'ipasndat': base + '.ipasndat'}
+    if opts['bin']:
+        d['ipasnbin'] = base + '.ipasnbin'
+    if opts['ipv6']:
+        d['ipv6'] = base + '.ipv6.ipasndat'
+    if opts['moas']:
+        d['moas'] = base + '.moas'
+    return d
+
+
+def up_to_date(dump_file, outputs, entry, opts):
+    if entry is None or entry.get('status') != 'ok' or entry.get('options') != opts:
+        return False
+    st = os.stat(dump_file)
+    if entry.get('size') != st.st_size or entry.get('mtime') != int(st.st_mtime):
+        return False
+    for path in outputs.itervalues():
+        if not os.path.exists(path) or os.path.getmtime(path) < st.st_mtime:
+            return False
+    return True
+
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    return json.load(open(path))
+
+
+# written under a temporary name and renamed, so an interrupted run never
+# leaves a truncated manifest behind
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST)
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    fw = open(tmp, 'w')
+    try:
+        json.dump(manifest, fw, indent=1, sort_keys=True, separators=(',', ': '))
+        fw.write('\n')
+    finally:
+        fw.close()
+    os.rename(tmp, path)
+
+
+
+# worker side: converts one file; never raises, failures are reported in the result
+def convert_one(args):
+    dump_file, outputs, opts, decompress = args
+    sys.stdout = open(os.devnull, 'w')  # convert_rib progress output
+
+    r = {'status': 'ok'}
+    try:
+        r['stats'] = convert_rib.convert_file(dump_file, outputs['ipasndat'],
+            bin_file=outputs.get('ipasnbin'), aggregate=opts['aggregate'],
+            ipv6_file=outputs.get('ipv6'), decompress=decompress,
+            majority=opts['majority'], moas_file=outputs.get('moas'))
+    except Exception:
+        r['status'] = 'failed'
+        r['error'] = traceback.format_exc().strip().split('\n')[-1]
+
+    r['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    return r
+
+
+# worker process: converts one file and sends the result back over conn
+def convert_worker(conn, args):
+    conn.send(convert_one(args))
+    conn.close()
+
+
+# converts todo, [(dump_file, outputs)], calling done(dump_file, result) as
+# each file finishes. each file gets a process of its own, so one large table
+# does not stay in a worker's heap, and a worker that dies without a result
+# (such as one killed by the OOM killer) is reported as failed.
+def run(todo, opts, decompress, jobs, memory, file_memory, done):
+    ratio = None   # highest peak RSS (MB) per compressed MB so far
+    running = []   # (process, connection, dump_file, estimate MB)
+    todo = list(todo)
+
+    def estimate(dump_file):
+        if ratio is None:
+            return file_memory
+        return max(1, int(ratio * os.path.getsize(dump_file) / 1e6))
+
+    try:
+        while todo or running:
+            used = sum(x[3] for x in running)
+            while todo and len(running) < jobs:
+                dump_file, outputs = todo[0]
+                est = estimate(dump_file)
+                if running and used + est > memory:
+                    break
+                todo.pop(0)
+                conn, child_conn = multiprocessing.Pipe(False)
+                p = multiprocessing.Process(target=convert_worker, args=(child_conn, (dump_file, outputs, opts, decompress)))
+                p.start()
+                child_conn.close()
+                running.append((p, conn, dump_file, est))
+                used += est
+
+            finished = []
+            for x in running:
+                p, conn = x[0], x[1]
+                # a worker that had exited before the poll has sent all it will
+                exited = p.exitcode is not None
+                if conn.poll():
+                    try:
+                        r = conn.recv()
+                    except EOFError:  # exited without sending
+                        p.join()
+                        r = None
+                elif exited:
+                    r = None
+                else:
+                    continue
+
+                p.join()
+                conn.close()
+                if r is None:
+                    r = {'status': 'failed'}
+                    if p.exitcode < 0:
+                        r['error'] = 'killed by signal %d' % -p.exitcode
+                    else:
+                        r['error'] = 'worker exited with code %d' % p.exitcode
+                finished.append((x, r))
+
+            if not finished:
+                time.sleep(0.1)
+                continue
+
+            for x, r in finished:
+                running.remove(x)
+                dump_file = x[2]
+                if r['status'] == 'ok':
+                    size_mb = os.path.getsize(dump_file) / 1e6
+                    if size_mb > 0:
+                        ratio = max(ratio, r['peak_rss_mb'] / size_mb)
+                done(dump_file, r)
+        #
+    finally:
+        for x in running:
+            x[0].terminate()
+            x[0].join()
+
+
+
+def main():
+    print 'MRT RIB batch converter v1.0.'
+
+    parser = argparse.ArgumentParser(
+        usage='batch_convert.py  [options]  -o OUT_DIR   <rib file, dir or glob> ...'
+    )
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('-o', dest='out_dir', required=True, metavar='OUT_DIR')
+    parser.add_argument('-j', '--jobs', type=int, default=0, metavar='N',
+        help='convert up to N files at once (0 = one per cpu)')
+    parser.add_argument('--memory', type=int, metavar='MB',
+        help='memory budget for the running conversions (default: half the physical memory)')
+    parser.add_argument('--file-memory', type=int, default=1024, metavar='MB',
+        help='memory estimate per file until the first one finishes')
+    parser.add_argument('--pattern', default='rib.*',
+        help='file name pattern for directory inputs')
+    parser.add_argument('--root', metavar='DIR',
+        help='name inputs and outputs by their path relative to DIR '
+             '(default: the deepest directory holding all the inputs)')
+    parser.add_argument('--force', action='store_true',
+        help='convert files even if their outputs are up to date')
+    parser.add_argument('--bin', action='store_true',
+        help='also write .ipasnbin files (see ipasndat.py)')
+    parser.add_argument('--aggregate', action='store_true',
+        help='merge prefixes with the same origin where lookups are unaffected')
+    parser.add_argument('--ipv6', action='store_true',
+        help='also write .ipv6.ipasndat files (TABLE_DUMP_V2 dumps)')
+    parser.add_argument('--majority', action='store_true',
+        help='use the origin announced by most peers (see convert_rib.py)')
+    parser.add_argument('--moas', action='store_true',
+        help='also write .moas files (implies --majority)')
+    parser.add_argument('--decompress', default='builtin', metavar='MODE',
+        help='decompression mode, as in convert_rib.py')
+    args = parser.parse_args()
+
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    memory = args.memory or os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (2 << 20)
+    opts = dict((k, getattr(args, k)) for k in OPTIONS)
+    st = time.time()
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    manifest = read_manifest(args.out_dir)
+
+    inputs = find_inputs(args.inputs, args.pattern)
+    root = os.path.abspath(args.root) if args.root else common_dir(inputs)
+
+    # manifest key and outputs of every input; both must be unique
+    keys = {}
+    owners = {}
+    for dump_file in inputs:
+        key = os.path.relpath(dump_file, root)
+        if key.startswith(os.pardir + os.sep):
+            parser.error('%s is not under --root %s' % (dump_file, root))
+        base = output_files(key, args.out_dir, opts)['ipasndat']
+        if key in owners or base in owners:
+            parser.error('%s and %s would share outputs' % (owners.get(key) or owners[base], dump_file))
+        keys[dump_file] = key
+        owners[key] = owners[base] = dump_file
+
+    todo = []
+    for dump_file in inputs:
+        outputs = output_files(keys[dump_file], args.out_dir, opts)
+        if not args.force and up_to_date(dump_file, outputs, manifest.get(keys[dump_file]), opts):
+            continue
+        out_dir = os.path.dirname(outputs['ipasndat'])
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        todo.append((dump_file, outputs))
+
+    print '%d files, %d up to date, %d to convert with %d jobs in %d MB' % (
+        len(inputs), len(inputs) - len(todo), len(todo), jobs, memory)
+
+    outputs = dict(todo)
+    failed = []
+
+    def done(dump_file, r):
+        st = os.stat(dump_file)
+        r.update({
+            'input': os.path.abspath(dump_file),
+            'size': st.st_size,
+            'mtime': int(st.st_mtime),
+            'options': opts,
+            'outputs': outputs[dump_file],
+            'converted_on': time.asctime(),
+        })
+        manifest[keys[dump_file]] = r
+        write_manifest(args.out_dir, manifest)
+
+        if r['status'] == 'ok':
+            print '%s: %d CIDRs in %.1fs, %d MB' % (dump_file, r['stats']['cidrs'], r['stats']['secs'], r['peak_rss_mb'])
+        else:
+            failed.append(dump_file)
+            print '%s: FAILED: %s' % (dump_file, r['error'])
+        sys.stdout.flush()
+
+    run(todo, opts, args.decompress, jobs, memory, args.file_memory, done)
+
+    print 'Converted %d files (%d failed) in %.1fs' % (len(todo) - len(failed), len(failed), time.time()-st)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
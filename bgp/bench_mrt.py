@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+# throughput benchmark for mrt_ex.py / convert_rib.py.
+#
+# runs the parsing pipeline on a RIB dump one stage further each time, every
+# run in a fresh process, and reports records/sec, MB/sec of decompressed MRT
+# data and peak RSS per stage. each stage includes the work of the ones before
+# it; the +secs column is the cost added by the stage itself. every stage runs
+# --repeat times and the fastest run counts; a +secs smaller than the spread
+# between the runs of the stage or the one before is within noise: it is
+# marked ~ (noise in --json), and shown as 0 if negative.
+#
+#   decompress   decompression only
+#   scan         + MRT record framing (mrt_ex.iter_records, bodies not decoded)
+#   parse        + decoding the prefix and entry headers of every RIB record
+#   as_path      + decoding the first entry's AS path and origin
+#   convert      the full convert_rib.py conversion, including the final sort
+#
+# without a dump file a synthetic one is generated with mrt_gen.py. --decompress
+# picks the rib_input.py decompression mode for every stage.
+
+import argparse
+import json
+import multiprocessing
+import os
+import Queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import convert_rib
+import mrt_ex
+import mrt_gen
+import rib_input
+
+
+STAGES = ['decompress', 'scan', 'parse', 'as_path', 'convert']
+
+
+
+# each stage returns (records, decompressed bytes)
+def stage_decompress(path, tdv, mode):
+    f = rib_input.open_dump(path, mode)
+    size = 0
+    while True:
+        s = f.read(1 << 20)
+        if not s:
+            break
+        size += len(s)
+    f.close()
+    return None, size
+
+
+def stage_scan(path, tdv, mode):
+    f = rib_input.open_dump(path, mode)
+    nn = size = 0
+    for rec in mrt_ex.iter_records(f):
+        nn += 1
+        size += mrt_ex.MRTHeader2.HDR_LEN + rec.len
+    f.close()
+    return nn, size
+
+
+def stage_parse(path, tdv, mode, as_path=False):
+    f = rib_input.open_dump(path, mode)
+    nn = size = 0
+    types = convert_rib.record_types(tdv)
+    for rec in mrt_ex.iter_records(f):
+        nn += 1
+        size += mrt_ex.MRTHeader2.HDR_LEN + rec.len
+        if (rec.type, rec.subtype) not in types:
+            continue
+        td = rec.body()
+        if as_path:
+            # the origin as convert_rib.py finds it
+            if tdv == 2:
+                td.entries[0].origin()
+            else:
+                td.as_path().owning_asn()
+    f.close()
+    return nn, size
+
+
+def stage_as_path(path, tdv, mode):
+    return stage_parse(path, tdv, mode, as_path=True)
+
+
+def stage_convert(path, tdv, mode):
+    f = rib_input.open_dump(path, mode)
+    table, nn = convert_rib.convert(f, tdv)
+    size = f.tell()
+    f.close()
+    table.sort()
+    return nn, size
+
+
+# puts (None, (secs, records, bytes, peak rss)) on q, or (traceback, None)
+# when the stage raises
+def run_stage(stage, path, tdv, mode, q):
+    sys.stdout = open(os.devnull, 'w')  # convert_rib progress dots
+    try:
+        st = time.time()
+        nn, size = globals()['stage_' + stage](path, tdv, mode)
+        secs = time.time() - st
+        q.put((None, (secs, nn, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)))
+    except Exception:
+        q.put((traceback.format_exc(), None))
+
+
+# waits for the result of the stage run by process p
+def stage_result(stage, p, q):
+    while True:
+        exited = p.exitcode is not None
+        try:
+            err, res = q.get(True, 1)
+            break
+        except Queue.Empty:
+            # a child that exited before the wait had flushed its result
+            if exited:
+                raise Exception('stage %s: process exited with code %d' % (stage, p.exitcode))
+    #
+
+    if err is not None:
+        raise Exception('stage %s failed:\n%s' % (stage, err))
+    return res
+
+
+# runs stage once in a child process; returns (secs, records, bytes, peak rss)
+def run_once(stage, path, tdv, mode):
+    q = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_stage, args=(stage, path, tdv, mode, q))
+    p.start()
+    try:
+        return stage_result(stage, p, q)
+    finally:
+        p.join()
+
+
+# runs each stage repeat times; returns a list of result dicts
+def bench(path, stages=STAGES, mode='builtin', repeat=3):
+    tdv = convert_rib.rib_type(path, mode)
+
+    results = []
+    prev = prev_spread = 0.0
+    for stage in stages:
+        runs = [run_once(stage, path, tdv, mode) for i in range(repeat)]
+        secs, nn, size, rss = min(runs)
+        times = [r[0] for r in runs]
+        spread = max(times) - min(times)
+        added = secs - prev
+
+        # nn is None for the decompress stage, which does not see records
+        results.append({
+            'stage': stage,
+            'secs': round(secs, 3),
+            'added_secs': round(max(added, 0.0), 3),
+            'noise': added < max(spread, prev_spread),
+            'records': nn,
+            'records_per_sec': int(nn / secs) if nn and secs else None,
+            'mb_per_sec': round(size / 1e6 / secs, 2) if secs else None,
+            'peak_rss_kb': max(r[3] for r in runs),
+        })
+        prev, prev_spread = secs, spread
+
+    return results
+
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='bench_mrt.py  [options]  [<ribmrtdump_file.bz2>]'
+    )
+    parser.add_argument('dump_file', nargs='?',
+        help='RIB dump to measure; a synthetic one is generated if omitted')
+    parser.add_argument('--stage', action='append', choices=STAGES,
+        help='only run these stages (repeatable)')
+    parser.add_argument('--json', action='store_true',
+        help='print one JSON line per stage')
+    parser.add_argument('--decompress', default='builtin', metavar='MODE',
+        help='decompression mode, as in convert_rib.py')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+        help='runs per stage, the fastest counts (default %(default)s)')
+    parser.add_argument('-t', '--table-dump', type=int, choices=[1, 2], default=2,
+        help='synthetic dump: TABLE_DUMP version')
+    parser.add_argument('-n', '--prefixes', type=int, default=100000, metavar='N',
+        help='synthetic dump: ipv4 prefixes')
+    parser.add_argument('-p', '--peers', type=int, default=8, metavar='N',
+        help='synthetic dump: maximum peers per prefix')
+    parser.add_argument('--path-len', default='2-8', metavar='MIN-MAX',
+        help='synthetic dump: AS path length before prepending')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmpdir = None
+    path = args.dump_file
+    try:
+        if path is None:
+            tmpdir = tempfile.mkdtemp(prefix='bench_mrt')
+            path = os.path.join(tmpdir, 'rib.synthetic.bz2')
+            lo, hi = [int(x) for x in args.path_len.split('-')]
+            gen = mrt_gen.RibGenerator(args.prefixes, args.peers, (lo, hi), seed=args.seed)
+            nn, size = gen.write(path, args.table_dump)
+            if not args.json:
+                print 'Generated TableDumpV%d dump: %d records, %.1f MB uncompressed' % (args.table_dump, nn, size / 1e6)
+
+        results = bench(path, args.stage or STAGES, args.decompress, max(1, args.repeat))
+
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    if args.json:
+        for r in results:
+            print json.dumps(r, sort_keys=True)
+        return
+
+    print '%-11s %8s %9s %10s %9s %8s %10s' % ('stage', 'secs', '+secs', 'records', 'rec/s', 'MB/s', 'peak RSS')
+    for r in results:
+        print '%-11s %8.2f %8.2f%s %10s %9s %8s %8d MB' % (r['stage'], r['secs'], r['added_secs'], '~' if r['noise'] else ' ',
+            r['records'] if r['records'] is not None else '-',
+            r['records_per_sec'] if r['records_per_sec'] is not None else '-',
+            r['mb_per_sec'], r['peak_rss_kb'] // 1024)
+
+
+if __name__ == '__main__':
+    main()
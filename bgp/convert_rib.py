@@ -2,155 +2,901 @@
 
 # MRT RIB log import  [to convert to a text IP-ASN lookup table]
 # Author hadi asghari (hd dot asghari at gmail) of TUDelft.nl
-# v1.0 on 25-nov-2009, v1.2 on 02-dec-2009  
+# v1.0 on 25-nov-2009, v1.2 on 02-dec-2009
+# v1.3: parallel parsing (-j), binary ipasndat output (--bin), prefix aggregation (--aggregate),
+#       ipv6 output (--ipv6), gzip/xz/raw input and pipelined decompression (--decompress),
+#       majority origin and MOAS listing (--majority, --moas), resumable conversion (--checkpoint),
+#       per-stage timing as JSON lines (--stats)
 
 
 # file to use per day should be of these series:
 # http://archive.routeviews.org/bgpdata/2009.11/RIBS/rib.20091125.0600.bz2
 
 
-import bz2
+import argparse
+import array
+import collections
+import cPickle
+import cStringIO
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import struct
 import time
 import sys
+import zlib
 
+import ipasndat
 import mrt_ex   # our own module, also included
+import rib_input
 #reload(mrt_ex) # for debugging
 
 
-print 'MRT RIB log importer v1.2.'
-
-
-#sys.argv = ['x', 'c:/users/hadi/downloads/rviews/20091202 rib.bz2', 'd:/asndat_20091202.dns_rib'] # for debugging
-
-if len(sys.argv) != 3:
-    print '\nUsage:  convert_rib.py   <ribmrtdump_file.bz2>   <ipasndat_file>'
-    print '\nDownload RIBs from: http://archive.routeviews.org/bgpdata/2009.xx/RIBS/xxx.bz2'		
-    sys.exit()
-
-
-dump_file = sys.argv[1] 
-out_file  = sys.argv[2] 
-st = time.time()
-
-
-f = bz2.BZ2File(dump_file, 'rb')
-
-dat = {}
-curly = {}
-as32 = {}
-excl = {}
-
-
-# get rib dump type
-s = f.read(mrt_ex.MRTHeader2.HDR_LEN)
-mrt_h = mrt_ex.MRTHeader2(s)
-tdv = 2 if mrt_h.type == mrt_ex.TABLE_DUMP_V2 else 1 if mrt_h.type == mrt_ex.TABLE_DUMP_V1 else -1
-if tdv == -1:
-    raise Exception('unknown table_dump type')
-
-print 'Processing %s\nRIB TableDumpV%d' % (f.name, tdv)
-f.seek(0)
-
-nn = 0
-seq_no = -1
-
-
-while True:
-    s = f.read(mrt_ex.MRTHeader2.HDR_LEN)
-    if len(s) == 0:
-        break    
-    assert len(s) == mrt_ex.MRTHeader2.HDR_LEN
-    
+# records handed to a worker process at once, in decompressed bytes
+CHUNK_SIZE = 4 << 20
+
+# seconds between checkpoints (--checkpoint)
+CHECKPOINT_EVERY = 60
+
+# seconds between --stats lines
+STATS_EVERY = 10
+
+
+
+# pickle state of obj with its array attributes as raw bytes, which pickle
+# far faster and smaller than arrays do (see Checkpoint)
+def _pack_arrays(obj, names):
+    d = obj.__dict__.copy()
+    for k in names:
+        d[k] = (d[k].typecode, d[k].tostring())
+    return d
+
+
+def _unpack_arrays(obj, d, names):
+    for k in names:
+        typecode, s = d[k]
+        d[k] = array.array(typecode)
+        d[k].fromstring(s)
+    obj.__dict__.update(d)
+
+
+
+# set of (prefix, bitmask) int pairs: one bitmap per prefix length up to /24
+# (4MB in all), the few longer prefixes in a plain set
+class PrefixSet:
+
+    BITMAP_MAX = 24
+
+    def __init__(self):
+        self.maps = [bytearray(((1 << m) + 7) >> 3) for m in range(self.BITMAP_MAX + 1)]
+        self.long = set()
+
+    def add(self, prefix, bitmask):
+        if bitmask <= self.BITMAP_MAX:
+            i = prefix >> (32 - bitmask)
+            self.maps[bitmask][i >> 3] |= 1 << (i & 7)
+        else:
+            self.long.add((prefix, bitmask))
+
+    def __contains__(self, k):
+        prefix, bitmask = k
+        if bitmask <= self.BITMAP_MAX:
+            i = prefix >> (32 - bitmask)
+            return bool(self.maps[bitmask][i >> 3] & (1 << (i & 7)))
+        return k in self.long
+
+    # the bitmaps pickle as plain strings (see Checkpoint)
+    def __getstate__(self):
+        return [str(m) for m in self.maps], self.long
+
+    def __setstate__(self, state):
+        maps, self.long = state
+        self.maps = [bytearray(m) for m in maps]
+
+
+
+# prefixes with a plain origin asn are kept in three parallel arrays, 9 bytes
+# per prefix. curly and as32 owners are never written out, so only their
+# counts are kept; excl is a set as it is not part of the first-match check.
+# moas lists (prefix, bitmask, [(origin, peers)]) for prefixes whose peers
+# disagree on the origin; only filled in --majority mode.
+# seen=False leaves out the first-match set, for the tables of the -j workers
+# that are only merged into another (see merge()).
+class RibTable:
+
+    def __init__(self, seen=True):
+        self.starts = array.array('I')
+        self.masks = array.array('B')
+        self.asns = array.array('I')
+        self.seen = PrefixSet() if seen else None
+        self.curly = 0
+        self.as32 = 0
+        self.excl = set()
+        self.moas = []
+
+    # k: (prefix, bitmask)
+    def __contains__(self, k):
+        return k in self.seen
+
+    def add(self, prefix, bitmask, owner):
+        if owner is None:  return
+        elif '{' in owner: self.curly += 1
+        elif '.' in owner: self.as32 += 1
+        elif '!' in owner: self.excl.add((prefix, bitmask)); return
+        else:
+            self.starts.append(prefix)
+            self.masks.append(bitmask)
+            self.asns.append(int(owner))
+        if self.seen is not None:
+            self.seen.add(prefix, bitmask)
+
+    # appends the entries of table t, as if added here one by one. seen is
+    # not updated: only TABLE_DUMP v1 conversions check it, and they add
+    # record by record
+    def merge(self, t):
+        self.starts.extend(t.starts)
+        self.masks.extend(t.masks)
+        self.asns.extend(t.asns)
+        self.curly += t.curly
+        self.as32 += t.as32
+        self.excl.update(t.excl)
+        self.moas.extend(t.moas)
+
+    # orders the table numerically by (prefix, bitmask) in one sort. drops the
+    # default route, and keeps the last one added if a prefix was added twice
+    def sort(self):
+        starts, masks, asns = self.starts, self.masks, self.asns
+        order = sorted(xrange(len(starts)), key=lambda i: starts[i] << 6 | masks[i])
+
+        self.starts = array.array('I')
+        self.masks = array.array('B')
+        self.asns = array.array('I')
+        for n, i in enumerate(order):
+            if n + 1 < len(order) and starts[order[n+1]] == starts[i] and masks[order[n+1]] == masks[i]:
+                continue
+            if masks[i] == 0 and starts[i] == 0:
+                continue  # remove default route
+            self.starts.append(starts[i])
+            self.masks.append(masks[i])
+            self.asns.append(asns[i])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getstate__(self):
+        return _pack_arrays(self, ('starts', 'masks', 'asns'))
+
+    def __setstate__(self, d):
+        _unpack_arrays(self, d, ('starts', 'masks', 'asns'))
+
+    # (prefix, bitmask, asn) of every prefix with a plain origin
+    def __iter__(self):
+        return itertools.izip(self.starts, self.masks, self.asns)
+
+
+
+# ipv6 counterpart of RibTable. only TABLE_DUMP_V2 dumps carry ipv6 here, so
+# there is no first-match check. each prefix is a 17 byte key (16 byte
+# prefix, bitmask) in one bytearray; keys sort numerically as bytes.
+class RibTable6:
+
+    KEY = struct.Struct('>QQB')
+
+    def __init__(self):
+        self.keys = bytearray()
+        self.asns = array.array('I')
+        self.curly = 0
+        self.as32 = 0
+        self.excl = set()
+        self.moas = []
+
+    def add(self, prefix, bitmask, owner):
+        if owner is None:  return
+        elif '{' in owner: self.curly += 1
+        elif '.' in owner: self.as32 += 1
+        elif '!' in owner: self.excl.add((prefix, bitmask))
+        else:
+            self.keys += self.KEY.pack(prefix >> 64, prefix & 0xffffffffffffffff, bitmask)
+            self.asns.append(int(owner))
+
+    # as RibTable.merge()
+    def merge(self, t):
+        self.keys += t.keys
+        self.asns.extend(t.asns)
+        self.curly += t.curly
+        self.as32 += t.as32
+        self.excl.update(t.excl)
+        self.moas.extend(t.moas)
+
+    # as RibTable.sort()
+    def sort(self):
+        n = self.KEY.size
+        keys, asns = self.keys, self.asns
+        order = sorted(xrange(len(asns)), key=lambda i: keys[n*i:n*i+n])
+
+        self.keys = bytearray()
+        self.asns = array.array('I')
+        for x, i in enumerate(order):
+            k = keys[n*i:n*i+n]
+            if x + 1 < len(order) and keys[n*order[x+1]:n*order[x+1]+n] == k:
+                continue
+            if k == '\0' * n:
+                continue  # remove default route
+            self.keys += k
+            self.asns.append(asns[i])
+
+    def __len__(self):
+        return len(self.asns)
+
+    def __getstate__(self):
+        d = _pack_arrays(self, ('asns',))
+        d['keys'] = str(self.keys)
+        return d
+
+    def __setstate__(self, d):
+        d['keys'] = bytearray(d['keys'])
+        _unpack_arrays(self, d, ('asns',))
+
+    # (prefix, bitmask, asn) of every prefix with a plain origin
+    def __iter__(self):
+        unpack_from, n = self.KEY.unpack_from, self.KEY.size
+        for i, asn in enumerate(self.asns):
+            hi, lo, bitmask = unpack_from(self.keys, n * i)
+            yield hi << 64 | lo, bitmask, asn
+
+
+
+# periodic snapshots of a conversion in progress, so that a killed run can
+# resume: the decompressed stream offset just past the last record converted,
+# the counters and the partial tables, pickled and zlib compressed. the file is
+# written under a temporary name and renamed, so a crash while saving leaves
+# the previous checkpoint intact. a checkpoint is only used for the same dump
+# (path, size and mtime) converted with the same options.
+class Checkpoint:
+
+    VERSION = 1
+
+    # options: anything that changes what the tables hold
+    def __init__(self, path, dump_file, options, interval=CHECKPOINT_EVERY):
+        st = os.stat(dump_file)
+        self.path = path
+        self.key = (self.VERSION, os.path.abspath(dump_file), st.st_size, int(st.st_mtime), options)
+        self.interval = interval
+        self.last = time.time()
+
+    # the saved state as a dict, or None when there is no usable checkpoint
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            state = cPickle.loads(zlib.decompress(open(self.path, 'rb').read()))
+        except Exception, e:
+            print 'Ignoring unreadable checkpoint %s: %s' % (self.path, e)
+            return None
+        if state.get('key') != self.key:
+            print 'Ignoring checkpoint %s of another dump or options' % self.path
+            return None
+        return state
+
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    def save(self, offset, nn, seq_no, in6, table, table6):
+        state = {'key': self.key, 'offset': offset, 'nn': nn, 'seq_no': seq_no, 'in6': in6,
+                 'table': table, 'table6': table6}
+        tmp = '%s.tmp%d' % (self.path, os.getpid())
+        fw = open(tmp, 'wb')
+        try:
+            fw.write(zlib.compress(cPickle.dumps(state, 2), 1))
+        finally:
+            fw.close()
+        os.rename(tmp, self.path)
+        self.last = time.time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+
+# where the time of a conversion goes: seconds per stage, records and bytes per
+# second and peak RSS. with an output file, one JSON object per line is
+# written every interval seconds while converting ("event": "progress") and
+# once at the end ("event": "done"), for get_rib.sh to log and for alerts on
+# slow conversions. the stages:
+#   read      reading the decompressed stream (the decompression itself, or
+#             waiting for the decompressor thread or pipe)
+#   header    record framing: MRT headers, skipping records not converted
+#   parse     decoding the RIB records and their entries
+#   as_path   finding the origin asn in the AS paths
+#   insert    adding to the tables
+#   wait      -j only: waiting for the workers
+#   checkpoint, sort, aggregate, write
+# with -j, parse and as_path are the cpu seconds of all workers together (as_path
+# including their adding to the chunk tables), insert is the merging and
+# header is the chunking of the stream. the per-record timing costs 5-10% on
+# uncompressed input, so without an output file no stages are timed.
+class Stats:
+
+    STAGES = ('read', 'header', 'parse', 'as_path', 'insert', 'wait', 'checkpoint', 'sort', 'aggregate', 'write')
+
+    # out: file object for the JSON lines, or None to only collect
+    def __init__(self, dump_file, out=None, interval=STATS_EVERY):
+        self.dump_file = dump_file
+        self.out = out
+        self.interval = interval
+        self.secs = dict.fromkeys(self.STAGES, 0.0)
+        self.records = 0   # converted in this run, not counting a resumed checkpoint's
+        self.bytes = 0     # decompressed bytes read
+        self.start = self.last = time.time()
+        self.clock = time.time if out is not None else _no_clock
+
+    # f with its reads timed and counted
+    def reader(self, f):
+        return TimedReader(f, self) if self.out is not None else f
+
+    def due(self):
+        return self.out is not None and time.time() - self.last >= self.interval
+
+    def summary(self, event='done'):
+        secs = time.time() - self.start
+        stages = dict((k, round(v, 3)) for k, v in self.secs.iteritems())
+        # the header timing includes the reads, and with -j the waits
+        stages['header'] = round(max(0, self.secs['header'] - self.secs['read'] - self.secs['wait']), 3)
+        return {
+            'event': event,
+            'file': self.dump_file,
+            'secs': round(secs, 3),
+            'records': self.records,
+            'bytes': self.bytes,
+            'records_per_sec': int(self.records / secs) if secs else 0,
+            'bytes_per_sec': int(self.bytes / secs) if secs else 0,
+            'stages': stages,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+            'workers_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // 1024,
+        }
+
+    # extra: more fields for the line, such as the final counts
+    def emit(self, event='progress', extra=None):
+        if self.out is None:
+            return
+        d = self.summary(event)
+        d.update(extra or {})
+        self.out.write(json.dumps(d, sort_keys=True) + '\n')
+        self.out.flush()
+        self.last = time.time()
+
+
+def _no_clock():
+    return 0.0
+
+
+class TimedReader:
+
+    def __init__(self, f, stats):
+        self.f = f
+        self.stats = stats
+
+    def read(self, n=-1):
+        t = time.time()
+        s = self.f.read(n)
+        self.stats.secs['read'] += time.time() - t
+        self.stats.bytes += len(s)
+        return s
+
+    # records skipped unparsed (mrt_ex._skip) are relative seeks, which
+    # decompress the bytes all the same: counted and timed as reads
+    def seek(self, offset, whence=0):
+        t = time.time()
+        self.f.seek(offset, whence)
+        self.stats.secs['read'] += time.time() - t
+        if whence == 1:
+            self.stats.bytes += offset
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+
+# get rib dump type, from the first record header. read separately since
+# piped input cannot seek back
+def rib_type(dump_file, decompress='builtin'):
+    s = rib_input.read_head(dump_file, mrt_ex.MRTHeader2.HDR_LEN, decompress)
     mrt_h = mrt_ex.MRTHeader2(s)
-    s = f.read(mrt_h.len)
-    assert len(s) == mrt_h.len
-        
-    nn += 1
-
-    if tdv == 2:
-        # TABLE_DUMP V2 importer
-        if nn % 5000 == 1: 
-            print '.',
-            sys.stdout.flush()
-            
-        assert mrt_h.type == mrt_ex.TABLE_DUMP_V2        
-        if mrt_h.subtype == mrt_ex.TableDumpV2.PEER_INDEX_TABLE:
-            continue 
-        assert mrt_h.subtype == mrt_ex.TableDumpV2.RIB_IPV4_UNICAST
-
-        td = mrt_ex.TableDumpV2(s)
-        k = (td.cidr, td.bitmask)
-		
-        #assert (k not in curly) and (k not in as32) and (k not in dat)
-
-        # the following code detects asn flips; however, since we understood
-        # that routeviews always takes the first match, there is no need for it
-        #owner = None    
-        #for e in td.entries:
-        #    as_path = e.as_path()
-        #    if owner is None:
-        #        owner = as_path.owning_asn()
-        #    elif owner != as_path.owning_asn():
-        #        flipped.add(k) 
-        #        break
-
-        owner = td.entries[0].as_path().owning_asn()            
-        assert owner is not None
-    #
-    
-    elif tdv == 1:        
-        # TABLE_DUMP-v1 importer code
-        if nn % 100000 == 1: 
-            print '.',
-            sys.stdout.flush()
-        
-        assert mrt_h.type == mrt_ex.TABLE_DUMP_V1
-        assert mrt_h.subtype == 1 # 'unexpected ip family: %d'
-
-        td = mrt_ex.TableDumpV1(s)       
-        k = (td.cidr, td.bitmask)        
-        owner = None
-        
-        if (k not in curly) and (k not in as32) and (k not in dat):
-            # only interested in getting the first match, that's why we check          
-            owner = td.as_path().owning_asn()
-            assert owner is not None
-    #    
-
+    tdv = 2 if mrt_h.type == mrt_ex.TABLE_DUMP_V2 else 1 if mrt_h.type == mrt_ex.TABLE_DUMP_V1 else -1
+    if tdv == -1:
+        raise Exception('unknown table_dump type')
 
-    if owner is None:  pass  
-    elif '{' in owner: curly[k]= owner
-    elif '.' in owner: as32[k] = owner
-    elif '!' in owner: excl[k] = owner
-    else:              dat[k]  = int(owner)
+    return tdv
 
-    #print '#%d\t%s\t/%d\t-> asn: %s' % (td.seq, k[0], k[1], owner)
 
+# only the records we convert are read; everything else is skipped unparsed
+def record_types(tdv, ipv6=False):
+    if tdv == 2:
+        l = [(mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.RIB_IPV4_UNICAST)]
+        if ipv6:
+            l.append((mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.RIB_IPV6_UNICAST))
+        return l
+    return [(mrt_ex.TABLE_DUMP_V1, 1)] # 'unexpected ip family: %d'
+
+
+# origin of a TABLE_DUMP_V2 record by majority of its entries (peers). returns
+# (origin, None) when all peers agree, else (origin, [(origin, peers)]) most
+# common first. ties go to the origin seen first, which is what the first-entry
+# conversion would pick.
+def consensus(td):
+    origins = [e.origin() for e in td.entries]
+    first = origins[0]
+    for o in origins:
+        if o != first:
+            break
+    else:
+        return first, None
+
+    counts = {}
+    order = []
+    for o in origins:
+        if o in counts:
+            counts[o] += 1
+        else:
+            counts[o] = 1
+            order.append(o)
+    order.sort(key=counts.__getitem__, reverse=True)  # stable, so ties keep stream order
+    return order[0], [(o, counts[o]) for o in order]
+
+
+def progress(nn, tdv):
+    if nn % (5000 if tdv == 2 else 100000) == 1:
+        print '.',
+        sys.stdout.flush()
+
+
+# progress() for records nn+1 .. nn+count at once
+def progress_many(nn, count, tdv):
+    step = 5000 if tdv == 2 else 100000
+    dots = (nn + count - 1) // step - (nn - 1) // step
+    if dots > 0:
+        print '. ' * (dots - 1) + '.',
+        sys.stdout.flush()
+
+
+# restart: the first ipv6 record, which may continue the numbering of the ipv4
+# records or start again at 0
+def check_seq(seq, seq_no, tdv, restart=False):
+    if restart and seq == 0:
+        return 0
     seq_no += 1
     if seq_no == 65536 and tdv == 1: seq_no = 0
-    assert td.seq == seq_no
-	
-#
-
-f.close()
-
-try: del dat['0.0.0.0', 0]  # remove default route
-except: pass
-
-print '\nRecords processed: %d in %.1fs' % (nn, time.time()-st)
-
-
-
-# CREATE OUTPUT FILE
-fw = open(out_file, 'w')
+    assert seq == seq_no
+    return seq_no
+
+
+# single process conversion; returns (table, records processed). ipv6 RIB
+# entries are only read when a RibTable6 is passed in, and go there. majority
+# (TABLE_DUMP_V2 only) reads the origin of every entry, see consensus().
+# ckpt: a Checkpoint to save to; resume: a state it loaded, to continue from
+# (the caller passes the resumed table6 in). stats: a Stats to time the stages
+# in, reading through its reader().
+def convert(f, tdv, table6=None, majority=False, ckpt=None, resume=None, stats=None):
+    table = RibTable()
+    nn = 0
+    seq_no = -1
+    in6 = False
+
+    if resume is not None:
+        table, nn, seq_no, in6 = resume['table'], resume['nn'], resume['seq_no'], resume['in6']
+        f.seek(resume['offset'])
+
+    if stats is None:
+        stats = Stats(None)
+    nn0 = nn
+    secs = stats.secs
+    clock = stats.clock
+
+    t = clock()
+    for rec in mrt_ex.iter_records(f, record_types(tdv, table6 is not None)):
+        t1 = clock()
+        secs['header'] += t1 - t
+        td = rec.body()
+        nn += 1
+        progress(nn, tdv)
+
+        k = (td.prefix, td.bitmask)
+        ipv6 = td.ipv6
+        t2 = clock()
+        secs['parse'] += t2 - t1
+
+        if tdv == 2:
+            # TABLE_DUMP V2 importer
+
+            #assert (k not in curly) and (k not in as32) and (k not in dat)
+
+            # routeviews always takes the first match; --majority instead takes
+            # the origin most peers agree on and records the asn flips (MOAS)
+            if majority:
+                owner, origins = consensus(td)
+                if origins is not None:
+                    (table6 if ipv6 else table).moas.append(k + (origins,))
+            else:
+                owner = td.entries[0].origin()
+            assert owner is not None
+        #
+
+        else:
+            # TABLE_DUMP-v1 importer code
+            owner = None
+
+            if k not in table:
+                # only interested in getting the first match, that's why we check
+                owner = td.as_path().owning_asn()
+                assert owner is not None
+        #
+
+        t3 = clock()
+        secs['as_path'] += t3 - t2
+
+        (table6 if ipv6 else table).add(td.prefix, td.bitmask, owner)
+
+        #print '#%d\t%s\t/%d\t-> asn: %s' % (td.seq, td.cidr, td.bitmask, owner)
+
+        seq_no = check_seq(td.seq, seq_no, tdv, ipv6 and not in6)
+        in6 = in6 or ipv6
+        t = clock()
+        secs['insert'] += t - t3
+
+        if nn % 1000 == 0:
+            if ckpt is not None and ckpt.due():
+                ckpt.save(f.tell(), nn, seq_no, in6, table, table6)
+                secs['checkpoint'] += clock() - t
+            if stats.due():
+                stats.records = nn - nn0
+                stats.emit()
+            t = clock()
+    #
 
-fw.write('; IP-ASN-DAT file\n; Original file : %s\n' % dump_file)
-fw.write('; Converted on  : %s\n; CIDRs         : %s\n; \n' % (time.asctime(), len(dat)) )
+    stats.records = nn - nn0
+    return table, nn
+
+
+# worker side of convert_parallel(): converts one chunk of whole records.
+# returns (count, first, last, table, table6, parse, as_path):
+#   count     records converted
+#   first     (seq, ipv6) of the first record, for the merge to check the
+#             sequence numbers against the previous chunk; None if count is 0
+#   last      (seq_no, in6, restarted) after the last record, check_seq()
+#             having run on the others here. restarted: a later record was
+#             taken as the ipv6 restart, valid only if no earlier chunk had
+#             ipv6 records
+#   table     TABLE_DUMP_V2: the RibTable(seen=False) of the chunk, and its
+#   table6    RibTable6 (or None), to merge in whole.
+#             TABLE_DUMP v1: the worker cannot know which prefixes earlier
+#             chunks had, so table is [(prefix, bitmask, owner)] of the
+#             records the first-match check may still take, in stream order:
+#             the first per prefix in this chunk, and any '!' owners before it
+#   parse, as_path  seconds spent parsing and in the AS paths when timed,
+#             for Stats
+def convert_chunk(args):
+    chunk, tdv, ipv6, majority, timed = args
+    parse = as_path = 0.0
+    clock = time.time if timed else _no_clock
 
-for cidr_mask,asn in sorted(dat.iteritems()):
-    s = '%s/%d\t%d\n' % (cidr_mask[0],cidr_mask[1],asn)
-    fw.write(s)
-fw.close()
+    if tdv == 2:
+        table, table6 = RibTable(seen=False), RibTable6() if ipv6 else None
+    else:
+        table, table6 = [], None
+        seen = set()
+
+    count = 0
+    first = None
+    seq_no = -1
+    in6 = restarted = False
+
+    for rec in mrt_ex.iter_records(cStringIO.StringIO(chunk), record_types(tdv, ipv6)):
+        t1 = clock()
+        td = rec.body()
+        t2 = clock()
+        k = (td.prefix, td.bitmask)
+
+        if tdv == 2:
+            t = table6 if td.ipv6 else table
+            if majority:
+                owner, origins = consensus(td)
+                if origins is not None:
+                    t.moas.append(k + (origins,))
+            else:
+                owner = td.entries[0].origin()
+            assert owner is not None
+            t.add(td.prefix, td.bitmask, owner)
 
+        elif k not in seen:
+            owner = td.as_path().owning_asn()
+            assert owner is not None
+            table.append(k + (owner,))
+            if '!' not in owner:
+                seen.add(k)
+
+        parse += t2 - t1
+        as_path += clock() - t2
+
+        if first is None:
+            first = (td.seq, td.ipv6)
+            seq_no = td.seq
+        else:
+            restart = td.ipv6 and not in6
+            seq_no = check_seq(td.seq, seq_no, tdv, restart)
+            restarted = restarted or (restart and td.seq == 0)
+        in6 = in6 or td.ipv6
+        count += 1
+    #
 
-print 'IPASNDAT file saved (%d CIDRs, else:%d/%d/%d)' % (len(dat), len(curly), len(as32), len(excl))
+    return count, first, (seq_no, in6, restarted), table, table6, parse, as_path
+
+
+# yields (end, results) for every chunk of f in stream order: the convert_chunk()
+# results and the stream offset just past the chunk, f being at offset start.
+# at most a few chunks per worker are in flight. the workers' timings and the
+# time spent waiting for them go to stats.
+def iter_chunk_results(f, start, tdv, ipv6, majority, pool, jobs, stats):
+    def get(r):
+        t = time.time()
+        results = r.get()
+        stats.secs['wait'] += time.time() - t
+        stats.secs['parse'] += results[-2]
+        stats.secs['as_path'] += results[-1]
+        return results[:-2]
+
+    pending = collections.deque()
+    end = start
+    for chunk in mrt_ex.iter_chunks(f, CHUNK_SIZE):
+        if len(pending) >= 2 * jobs:
+            e, r = pending.popleft()
+            yield e, get(r)
+        end += len(chunk)
+        pending.append((end, pool.apply_async(convert_chunk, [(chunk, tdv, ipv6, majority, stats.out is not None)])))
+
+    while pending:
+        e, r = pending.popleft()
+        yield e, get(r)
+
+
+# same result as convert(), with the records converted by a process pool.
+# this process decompresses and cuts the stream into chunks on record
+# boundaries; the workers resolve the owners and check the sequence numbers
+# within their chunk, and the chunk tables are merged back in order, checking
+# the sequence numbers across chunks and, for v1 dumps, the first match.
+# checkpoints are taken between chunks.
+def convert_parallel(f, tdv, jobs, table6=None, majority=False, ckpt=None, resume=None, stats=None):
+    table = RibTable()
+    nn = 0
+    seq_no = -1
+    in6 = False
+    start = 0
+
+    if resume is not None:
+        table, nn, seq_no, in6, start = resume['table'], resume['nn'], resume['seq_no'], resume['in6'], resume['offset']
+        f.seek(start)
+
+    if stats is None:
+        stats = Stats(None)
+    nn0 = nn
+    secs = stats.secs
+    clock = stats.clock
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        t0 = clock()
+        for end, results in iter_chunk_results(f, start, tdv, table6 is not None, majority, pool, jobs, stats):
+            t1 = clock()
+            secs['header'] += t1 - t0  # also holds the read and wait time, see Stats.summary()
+
+            count, first, last, t, t6 = results
+            if count:
+                progress_many(nn, count, tdv)
+                nn += count
+
+                if tdv == 2:
+                    table.merge(t)
+                    if t6 is not None:
+                        table6.merge(t6)
+                else:
+                    for prefix, bitmask, owner in t:
+                        if (prefix, bitmask) not in table:
+                            table.add(prefix, bitmask, owner)
+
+                seq, ipv6 = first
+                seq_no = check_seq(seq, seq_no, tdv, ipv6 and not in6)
+                assert not (last[2] and in6)
+                seq_no = last[0]
+                in6 = in6 or last[1]
+            #
+
+            t0 = clock()
+            secs['insert'] += t0 - t1
+
+            if ckpt is not None and ckpt.due():
+                ckpt.save(end, nn, seq_no, in6, table, table6)
+                secs['checkpoint'] += clock() - t0
+            if stats.due():
+                stats.records = nn - nn0
+                stats.emit()
+            t0 = clock()
+        #
+
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    stats.records = nn - nn0
+    return table, nn
+
+
+# entries: sized iterable of (prefix, bitmask, asn), in the order to write.
+# written under a temporary name and renamed into place, so a reader (such as
+# asnserver.py reloading the table) never sees a partial file
+def write_ipasndat(out_file, dump_file, entries, ipv6=False):
+    # CREATE OUTPUT FILE
+    tmp = '%s.tmp%d' % (out_file, os.getpid())
+    fw = open(tmp, 'w')
+
+    fw.write('; IP-ASN-DAT file\n; Original file : %s\n' % dump_file)
+    fw.write('; Converted on  : %s\n; CIDRs         : %s\n; \n' % (time.asctime(), len(entries)) )
+
+    int_to_ip = ipasndat.int_to_ip6 if ipv6 else ipasndat.int_to_ip
+    for prefix,bitmask,asn in entries:
+        s = '%s/%d\t%d\n' % (int_to_ip(prefix),bitmask,asn)
+        fw.write(s)
+    fw.close()
+    os.rename(tmp, out_file)
+
+
+# moas, moas6: (prefix, bitmask, [(origin, peers)]) as collected in RibTable.moas
+# and RibTable6.moas. one line per prefix, ipv4 first: cidr, then origin:peers
+# for each origin, tab separated
+def write_moas(out_file, dump_file, moas, moas6=()):
+    fw = open(out_file, 'w')
+
+    fw.write('; MOAS file\n; Original file : %s\n' % dump_file)
+    fw.write('; Converted on  : %s\n; CIDRs         : %s\n; \n' % (time.asctime(), len(moas) + len(moas6)) )
+
+    for l, int_to_ip in ((moas, ipasndat.int_to_ip), (moas6, ipasndat.int_to_ip6)):
+        for prefix,bitmask,origins in sorted(l):
+            fw.write('%s/%d\t%s\n' % (int_to_ip(prefix), bitmask, '\t'.join('%s:%d' % x for x in origins)))
+    fw.close()
+
+
+# converts dump_file into out_file and the optional extra outputs, as main()
+# does for its command line; returns a dict of counts for the caller to report.
+# stats_out: file object for the Stats lines
+def convert_file(dump_file, out_file, jobs=1, bin_file=None, aggregate=False, ipv6_file=None,
+                 decompress='builtin', majority=False, moas_file=None, checkpoint=None,
+                 checkpoint_every=CHECKPOINT_EVERY, stats_out=None, stats_every=STATS_EVERY):
+    st = time.time()
+    stats = Stats(dump_file, stats_out, stats_every)
+
+    tdv = rib_type(dump_file, decompress)
+    majority = majority or moas_file is not None
+    if majority and tdv != 2:
+        raise Exception('--majority and --moas need a TABLE_DUMP_V2 dump')
+    f = stats.reader(rib_input.open_dump(dump_file, decompress))
+
+    print 'Processing %s\nRIB TableDumpV%d' % (dump_file, tdv)
+
+    table6 = RibTable6() if ipv6_file else None
+
+    ckpt = resume = None
+    if checkpoint:
+        ckpt = Checkpoint(checkpoint, dump_file, (tdv, table6 is not None, majority), checkpoint_every)
+        resume = ckpt.load()
+        if resume is not None:
+            table6 = resume['table6']
+            print 'Resuming from %s after %d records' % (checkpoint, resume['nn'])
+
+    try:
+        if jobs > 1:
+            table, nn = convert_parallel(f, tdv, jobs, table6, majority, ckpt, resume, stats)
+        else:
+            table, nn = convert(f, tdv, table6, majority, ckpt, resume, stats)
+    finally:
+        f.close()
+
+    t = time.time()
+    table.sort()
+    if table6 is not None:
+        table6.sort()
+    stats.secs['sort'] += time.time() - t
+
+    print '\nRecords processed: %d in %.1fs' % (nn, time.time()-st)
+    counts = {'table_dump': tdv, 'records': nn, 'cidrs': len(table)}
+
+    entries = table
+    if aggregate:
+        t = time.time()
+        entries = ipasndat.aggregate(table)
+        stats.secs['aggregate'] += time.time() - t
+        print 'Aggregated %d CIDRs into %d' % (len(table), len(entries))
+        counts['aggregated'] = len(entries)
+
+    t = time.time()
+    write_ipasndat(out_file, dump_file, entries)
+
+    print 'IPASNDAT file saved (%d CIDRs, else:%d/%d/%d)' % (len(entries), table.curly, table.as32, len(table.excl))
+
+    if bin_file:
+        n = ipasndat.write_bin(bin_file, entries)
+        print 'IPASNBIN file saved (%d CIDRs)' % n
+
+    if table6 is not None:
+        write_ipasndat(ipv6_file, dump_file, table6, ipv6=True)
+        print 'IPv6 IPASNDAT file saved (%d CIDRs, else:%d/%d/%d)' % (len(table6), table6.curly, table6.as32, len(table6.excl))
+        counts['cidrs6'] = len(table6)
+
+    if moas_file:
+        moas6 = table6.moas if table6 is not None else ()
+        write_moas(moas_file, dump_file, table.moas, moas6)
+        print 'MOAS file saved (%d CIDRs)' % (len(table.moas) + len(moas6))
+        counts['moas'] = len(table.moas) + len(moas6)
+    stats.secs['write'] += time.time() - t
+
+    if ckpt is not None:
+        ckpt.remove()
+
+    stats.emit('done', counts)
+    counts['secs'] = round(time.time() - st, 1)
+    return counts
+
+
+def main():
+    print 'MRT RIB log importer v1.3.'
+
+    #sys.argv = ['x', 'c:/users/hadi/downloads/rviews/20091202 rib.bz2', 'd:/asndat_20091202.dns_rib'] # for debugging
+
+    parser = argparse.ArgumentParser(
+        usage='convert_rib.py  [-j N]  [--bin FILE]  [--aggregate]  [--ipv6 FILE]  [--decompress MODE]  [--majority]  [--moas FILE]  [--checkpoint FILE]  [--stats FILE]   <ribmrtdump_file.bz2>   <ipasndat_file>',
+        epilog='Download RIBs from: http://archive.routeviews.org/bgpdata/2009.xx/RIBS/xxx.bz2  (many files: see batch_convert.py)'
+    )
+    parser.add_argument('dump_file')
+    parser.add_argument('out_file')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+        help='parse records in N worker processes (0 = one per cpu)')
+    parser.add_argument('--bin', dest='bin_file', metavar='FILE',
+        help='also write the table in the mmap-able binary format (see ipasndat.py)')
+    parser.add_argument('--aggregate', action='store_true',
+        help='merge prefixes with the same origin where lookups are unaffected')
+    parser.add_argument('--ipv6', dest='ipv6_file', metavar='FILE',
+        help='also convert the ipv6 RIB entries of a TABLE_DUMP_V2 dump into this ipasndat file')
+    parser.add_argument('--decompress', default='builtin', metavar='MODE',
+        help='builtin, thread (decompress alongside parsing), external (lbzip2/pbzip2/pigz/xz pipe) '
+             'or a decompressor command such as "lbzip2 -dc -n 4" (see rib_input.py)')
+    parser.add_argument('--majority', action='store_true',
+        help='use the origin announced by most peers instead of the first peer\'s (TABLE_DUMP_V2 only)')
+    parser.add_argument('--moas', dest='moas_file', metavar='FILE',
+        help='list prefixes whose peers disagree on the origin in FILE (implies --majority)')
+    parser.add_argument('--checkpoint', metavar='FILE',
+        help='save progress to FILE periodically, and resume from it if it exists')
+    parser.add_argument('--checkpoint-every', type=float, default=CHECKPOINT_EVERY, metavar='SECS',
+        help='seconds between checkpoints (default %(default)s)')
+    parser.add_argument('--stats', metavar='FILE',
+        help='append stage timings and throughput to FILE as JSON lines, periodically and at the end (- = stderr)')
+    parser.add_argument('--stats-every', type=float, default=STATS_EVERY, metavar='SECS',
+        help='seconds between --stats lines (default %(default)s)')
+    args = parser.parse_args()
+
+    stats_out = None
+    if args.stats == '-':
+        stats_out = sys.stderr
+    elif args.stats:
+        stats_out = open(args.stats, 'a')
+
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    convert_file(args.dump_file, args.out_file, jobs, args.bin_file, args.aggregate, args.ipv6_file,
+                 args.decompress, args.majority, args.moas_file, args.checkpoint, args.checkpoint_every,
+                 stats_out, args.stats_every)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,10 @@ CONVERT_RIB="$BASE_RUN_DIR/convert_rib.py"
 ## Store converted BGP data to this file
 IP_ASN_DAT="$BASE_RUN_DIR/ipasndat"
 
+## Conversion timings as JSON lines of the last run (see --stats in convert_rib.py); the
+## run before it is kept in $CONVERT_STATS.1
+CONVERT_STATS="$BASE_RUN_DIR/convert_rib.stats"
+
 ## URL to retrieve latest BGP data
 BGP_DATA_URL="http://archive.routeviews.org/bgpdata/$(date -u +'%Y.%m')/RIBS"
 
@@ -80,7 +84,13 @@ done
 if [ ! -e $IP_ASN_DAT ]; then
 	## Convert the newest RIB file to something human-readable
 	write_log "   Running MRT RIB log importer"
-	$PYTHON $CONVERT_RIB $BGP_LOCAL_FILE $IP_ASN_DAT
+	[ -e $CONVERT_STATS ] && mv -f $CONVERT_STATS $CONVERT_STATS.1
+	## resumes from the checkpoint if an earlier run was killed partway
+	if $PYTHON $CONVERT_RIB --checkpoint $IP_ASN_DAT.ckpt --stats $CONVERT_STATS $BGP_LOCAL_FILE $IP_ASN_DAT; then
+		write_log "   Conversion stats: $(tail -n 1 $CONVERT_STATS)"
+	else
+		write_log "   Conversion failed with status $?" && exit 3
+	fi
 fi
 
 write_log "------------------- End run -------------------"
@@ -0,0 +1,290 @@
+# binary IP-ASN table, the compact counterpart of the text ipasndat file
+# written by convert_rib.py --bin.
+#
+# the file is a 24 byte header followed by five fixed-width arrays, all
+# little endian. the prefixes, sorted by (network start, prefix length):
+#
+#   header   'IPASNBIN'  uint32 version  uint32 count  uint32 ranges  4 x pad
+#   starts   uint32[count]    first address of each prefix
+#   asns     uint32[count]    origin asn
+#   masks    uint8[count]     prefix length, padded to a multiple of 4 bytes
+#
+# and the same prefixes flattened into disjoint address ranges, as flatten()
+# builds them, for longest-prefix matching by one binary search:
+#
+#   bounds   uint32[ranges]   first address of each range
+#   entries  uint32[ranges]   1 + index of the longest prefix covering the
+#                             range, 0 when no prefix does
+#
+# the arrays are used straight out of an mmap (see BinTable.match() and
+# asnlookup.MappedLookup), so loading costs no parsing and processes on the
+# same host share one page-cached copy.
+
+import array
+import bisect
+import mmap
+import os
+import socket
+import struct
+import sys
+
+
+MAGIC = 'IPASNBIN'
+VERSION = 2
+
+_HDR = struct.Struct('<8sIII4x')
+_U32 = struct.Struct('<I')
+_U8 = struct.Struct('B')
+
+ADDR_SPACE = 1 << 32
+
+
+def ip_to_int(ip):
+    return struct.unpack('>I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(n):
+    return socket.inet_ntoa(struct.pack('>I', n))
+
+
+def ip6_to_int(ip):
+    hi, lo = struct.unpack('>QQ', socket.inet_pton(socket.AF_INET6, ip))
+    return hi << 64 | lo
+
+
+def int_to_ip6(n):
+    return socket.inet_ntop(socket.AF_INET6, struct.pack('>QQ', n >> 64, n & 0xffffffffffffffff))
+
+
+# collapses entries, (start, mask, asn) integer tuples, without changing the
+# longest-prefix-match result of any address:
+#  - a prefix is dropped when its closest covering prefix has the same asn
+#  - two sibling prefixes with the same asn are replaced by their parent (an
+#    existing parent entry is fully shadowed by the pair, so it is replaced)
+# both steps repeat until nothing changes. returns a sorted list.
+def aggregate(entries):
+    t = dict(((start, mask), asn) for start, mask, asn in entries)
+
+    changed = True
+    while changed:
+        changed = False
+
+        # covered prefixes with the origin of their closest cover. removing one
+        # never changes the closest-cover asn seen by another, so one pass will do
+        lengths = sorted(set(mask for start, mask in t), reverse=True)
+        for (start, mask), asn in t.items():
+            for m in lengths:
+                if m >= mask:
+                    continue
+                cover = t.get((start & (0xffffffff << (32 - m)) & 0xffffffff, m))
+                if cover is not None:
+                    if cover == asn:
+                        del t[start, mask]
+                        changed = True
+                    break
+
+        # sibling pairs, longest first so merged parents can merge again
+        starts = [[] for m in xrange(33)]  # by mask
+        for start, mask in t:
+            starts[mask].append(start)
+
+        for mask in xrange(32, 0, -1):
+            bit = 1 << (32 - mask)
+            for start in starts[mask]:
+                if start & bit:
+                    continue  # the right sibling is handled with its left one
+                asn = t.get((start, mask))
+                if asn is not None and t.get((start | bit, mask)) == asn:
+                    del t[start, mask], t[start | bit, mask]
+                    t[start, mask - 1] = asn
+                    starts[mask - 1].append(start)
+                    changed = True
+
+    return sorted((start, mask, asn) for (start, mask), asn in t.iteritems())
+
+
+# flattens entries, an iterable of (start, mask, value) integer tuples with
+# possibly nested prefixes, into disjoint address ranges: returns arrays
+# (bounds, values) where bounds[i] is the first address of range i and
+# values[i] the value of the longest prefix covering it (0 when none does).
+# adjacent ranges with the same value are merged.
+def flatten(entries):
+    bounds = array.array('I', [0])
+    values = array.array('I', [0])
+
+    # starts a range at address start, dropping the previous one if it is empty
+    def add_range(start, value):
+        if start >= ADDR_SPACE:
+            return  # empty range past the end of the address space
+
+        if start == bounds[-1]:
+            if len(bounds) == 1:
+                values[0] = value
+                return
+            bounds.pop()
+            values.pop()
+
+        if value != values[-1]:
+            bounds.append(start)
+            values.append(value)
+
+    stack = []  # (end, value) of the prefixes covering the cursor, innermost last
+    cursor = 0
+
+    for start, mask, value in sorted(entries):
+        # close the prefixes that end before this one starts
+        while stack and stack[-1][0] <= start:
+            end, v = stack.pop()
+            add_range(cursor, v)
+            cursor = end
+
+        if cursor < start:
+            add_range(cursor, stack[-1][1] if stack else 0)
+            cursor = start
+
+        stack.append((start + (1 << (32 - mask)), value))
+    #
+
+    while stack:
+        end, v = stack.pop()
+        add_range(cursor, v)
+        cursor = end
+
+    if cursor < ADDR_SPACE:
+        add_range(cursor, 0)
+
+    return bounds, values
+
+
+# writes entries, an iterable of (start, mask, asn) integer tuples, to path.
+# the file is written under a temporary name and renamed into place, so
+# readers that have the old table mapped never see a partial file.
+def write_bin(path, entries):
+    starts = array.array('I')
+    asns = array.array('I')
+    masks = array.array('B')
+    assert starts.itemsize == 4
+
+    for start, mask, asn in sorted(entries):
+        starts.append(start)
+        asns.append(asn)
+        masks.append(mask)
+
+    count = len(starts)
+    bounds, indexes = flatten((starts[i], masks[i], i + 1) for i in xrange(count))
+    masks.extend([0] * (-count % 4))
+
+    if sys.byteorder != 'little':
+        for a in (starts, asns, bounds, indexes):
+            a.byteswap()
+
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    fw = open(tmp, 'wb')
+    try:
+        fw.write(_HDR.pack(MAGIC, VERSION, count, len(bounds)))
+        starts.tofile(fw)
+        asns.tofile(fw)
+        masks.tofile(fw)
+        bounds.tofile(fw)
+        indexes.tofile(fw)
+    finally:
+        fw.close()
+    os.rename(tmp, path)
+    return count
+
+
+
+# read-only sequence view of count little endian uint32s at byte offset off
+# of buf, for bisect
+class U32Array:
+
+    def __init__(self, buf, off, count):
+        self.buf = buf
+        self.off = off
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return _U32.unpack_from(self.buf, self.off + 4 * i)[0]
+
+
+
+class BinTable:
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if len(self.mm) < _HDR.size:
+            raise Exception('%s: truncated IPASNBIN file' % path)
+        magic, version, self.count, self.ranges = _HDR.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise Exception('%s: not an IPASNBIN file' % path)
+        if version != VERSION:
+            raise Exception('%s: IPASNBIN version %d, expected %d; convert the dump again' % (path, version, VERSION))
+
+        # byte offsets of the arrays
+        self.starts_off = _HDR.size
+        self.asns_off = self.starts_off + 4 * self.count
+        self.masks_off = self.asns_off + 4 * self.count
+        self.bounds_off = self.masks_off + self.count + (-self.count % 4)
+        self.entries_off = self.bounds_off + 4 * self.ranges
+
+        if len(self.mm) < self.entries_off + 4 * self.ranges:
+            raise Exception('%s: truncated IPASNBIN file' % path)
+
+        self.bounds = U32Array(self.mm, self.bounds_off, self.ranges)
+        self.range_entries = U32Array(self.mm, self.entries_off, self.ranges)
+
+    def __len__(self):
+        return self.count
+
+    # index of the longest prefix covering ip (an int), or -1; a binary
+    # search of the flattened ranges in the mmap
+    def match_index(self, ip):
+        i = bisect.bisect_right(self.bounds, ip) - 1
+        return self.range_entries[i] - 1
+
+    # (start, mask, asn) of the longest prefix covering ip (an int), or None
+    def match(self, ip):
+        i = self.match_index(ip)
+        return self[i] if i >= 0 else None
+
+    def start(self, i):
+        return _U32.unpack_from(self.mm, self.starts_off + 4 * i)[0]
+
+    def asn(self, i):
+        return _U32.unpack_from(self.mm, self.asns_off + 4 * i)[0]
+
+    def mask(self, i):
+        return _U8.unpack_from(self.mm, self.masks_off + i)[0]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.start(i), self.mask(i), self.asn(i)
+
+    # (cidr, mask, asn) for every entry, as in the text file
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield int_to_ip(self.start(i)), self.mask(i), self.asn(i)
+
+    def close(self):
+        self.mm.close()
+
+    def __str__(self):
+        return 'BinTable{count:%d}' % self.count
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,377 @@
+#!/usr/bin/python
+
+# IP-ASN history: the prefix ownership of many consecutive convert_rib.py
+# outputs in one file, for "who originated this ip on date X" queries.
+#
+# every (prefix, asn) pair is stored once, with the range of snapshots it was
+# seen in, so a day that changes nothing costs nothing but its timestamp.
+# the layout follows IPASNBIN (see ipasndat.py): a header and fixed-width
+# little endian arrays, read through an mmap, records sorted by
+# (start, mask, valid_from):
+#
+#   header      'IPASNHIS'  uint32 version  uint32 snapshots  uint32 count
+#               uint64 lengths (bit m set when some /m prefix is present)  4 bytes padding
+#   times       uint32[snapshots]  snapshot times, unix utc, increasing
+#   starts      uint32[count]      first address of the prefix
+#   asns        uint32[count]      origin asn
+#   valid_from  uint32[count]      index of the first snapshot with this origin
+#   valid_to    uint32[count]      index of the first snapshot without it, OPEN if
+#                                  it is still in the latest
+#   masks       uint8[count]       prefix length, padded to a multiple of 4 bytes
+#
+# a point-in-time lookup binary searches the records of each prefix length
+# present, so it reads a few hundred bytes of the file, not a snapshot.
+#
+#   ipasnhist.py build  hist  rib.20091125.0600.ipasndat rib.20091126.0600.ipasndat ...
+#   ipasnhist.py add    hist  rib.20091127.0600.ipasndat
+#   ipasnhist.py lookup hist  20091126 8.8.8.8
+#   ipasnhist.py history hist 8.8.8.8 [20091101 [20091201]]
+#
+# snapshot times are taken from the YYYYMMDD[.HHMM] in the file names.
+
+import argparse
+import array
+import bisect
+import calendar
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+
+import asnlookup
+import ipasndat
+
+
+MAGIC = 'IPASNHIS'
+VERSION = 1
+OPEN = 0xffffffff
+
+_HDR = struct.Struct('<8sIIIQ4x')
+_U32 = struct.Struct('<I')
+_U8 = struct.Struct('B')
+
+
+
+# unix time of the first YYYYMMDD[.HHMM] in s, or None
+def parse_time(s):
+    m = re.search(r'(\d{8})(?:[.\-_T]?(\d{4}))?(?!\d)', s)
+    if m is None:
+        return None
+    return calendar.timegm(time.strptime(m.group(1) + (m.group(2) or '0000'), '%Y%m%d%H%M'))
+
+
+def format_time(t):
+    return time.strftime('%Y%m%d.%H%M', time.gmtime(t))
+
+
+
+class HistTable:
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        magic, version, self.snapshots, self.count, lengths = _HDR.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('%s: not an IPASNHIS v%d file' % (path, VERSION))
+
+        # longest first, for longest-prefix matching
+        self.lengths = [m for m in xrange(32, -1, -1) if lengths >> m & 1]
+
+        off = _HDR.size
+        self.times = list(struct.unpack_from('<%dI' % self.snapshots, self.mm, off))
+        off += 4 * self.snapshots
+        self.starts_off = off
+        self.asns_off = off + 4 * self.count
+        self.from_off = off + 8 * self.count
+        self.to_off = off + 12 * self.count
+        self.masks_off = off + 16 * self.count
+
+        if len(self.mm) < self.masks_off + self.count:
+            raise Exception('%s: truncated IPASNHIS file' % path)
+
+    def __len__(self):
+        return self.count
+
+    def start(self, i):
+        return _U32.unpack_from(self.mm, self.starts_off + 4 * i)[0]
+
+    def mask(self, i):
+        return _U8.unpack_from(self.mm, self.masks_off + i)[0]
+
+    # (start, mask, asn, valid_from, valid_to) of record i
+    def __getitem__(self, i):
+        mm = self.mm
+        return (_U32.unpack_from(mm, self.starts_off + 4 * i)[0], _U8.unpack_from(mm, self.masks_off + i)[0],
+                _U32.unpack_from(mm, self.asns_off + 4 * i)[0], _U32.unpack_from(mm, self.from_off + 4 * i)[0],
+                _U32.unpack_from(mm, self.to_off + 4 * i)[0])
+
+    # index of the latest snapshot taken at or before unix time t, or None
+    def snapshot_index(self, t):
+        i = bisect.bisect_right(self.times, t) - 1
+        return i if i >= 0 else None
+
+    # [(valid_from, valid_to, asn)] of prefix start/mask, oldest first
+    def intervals(self, start, mask):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (self.start(mid), self.mask(mid)) < (start, mask):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        l = []
+        while lo < self.count and self.start(lo) == start and self.mask(lo) == mask:
+            l.append(self[lo][2:])
+            lo += 1
+        return [(f, t, asn) for asn, f, t in l]
+
+    # (start, mask, asn) of the longest prefix covering ip (dotted quad or int)
+    # in the snapshot in effect at unix time t, or None
+    def match(self, ip, t):
+        if not isinstance(ip, (int, long)):
+            ip = ipasndat.ip_to_int(ip)
+        i = self.snapshot_index(t)
+        if i is None:
+            return None
+
+        for m in self.lengths:
+            start = ip & (0xffffffff << (32 - m)) & 0xffffffff
+            for f, to, asn in self.intervals(start, m):
+                if f <= i < to:
+                    return start, m, asn
+        return None
+
+    # origin asn of ip at unix time t, or None
+    def lookup(self, ip, t):
+        r = self.match(ip, t)
+        return r[2] if r is not None else None
+
+    # the longest-prefix match of ip over the snapshots between unix times
+    # since and until (all if None), as [(from_time, to_time, start, mask, asn)]
+    # periods. to_time is the first snapshot after the period, None if the
+    # period runs to the latest one. periods where ip is unrouted are left out.
+    def history(self, ip, since=None, until=None):
+        if not isinstance(ip, (int, long)):
+            ip = ipasndat.ip_to_int(ip)
+        first = self.snapshot_index(since) if since is not None else 0
+        if first is None:
+            first = 0
+        last = self.snapshot_index(until) if until is not None else self.snapshots - 1
+        if last is None or last < first:
+            return []
+        end = last + 1
+
+        candidates = []  # (mask, start, valid_from, valid_to, asn)
+        bounds = set([first, end])
+        for m in self.lengths:
+            start = ip & (0xffffffff << (32 - m)) & 0xffffffff
+            for f, to, asn in self.intervals(start, m):
+                if f < end and to > first:
+                    candidates.append((m, start, f, to, asn))
+                    bounds.update(x for x in (f, to) if first < x < end)
+        #
+
+        l = []
+        bounds = sorted(bounds)
+        for b, e in zip(bounds, bounds[1:]):
+            best = None
+            for c in candidates:
+                if c[2] <= b < c[3] and (best is None or c[0] > best[0]):
+                    best = c
+            if best is None:
+                continue
+            m, start, f, to, asn = best
+            if l and l[-1][2:] == [start, m, asn] and l[-1][1] == b:
+                l[-1][1] = e
+            else:
+                l.append([b, e, start, m, asn])
+
+        return [(self.times[b], self.times[e] if e < self.snapshots else None, start, m, asn)
+                for b, e, start, m, asn in l]
+
+    # (start, mask, asn) of every prefix in the snapshot in effect at unix
+    # time t; for many lookups at one time, e.g. asnlookup.AsnLookup(h.snapshot(t))
+    def snapshot(self, t):
+        i = self.snapshot_index(t)
+        if i is None:
+            return []
+        l = []
+        for x in xrange(self.count):
+            start, mask, asn, f, to = self[x]
+            if f <= i < to:
+                l.append((start, mask, asn))
+        return l
+
+    def close(self):
+        self.mm.close()
+
+    def __str__(self):
+        return 'HistTable{snapshots:%d,count:%d}' % (self.snapshots, self.count)
+
+    def __repr__(self):
+        return str(self)
+
+
+
+# accumulates snapshots, in time order, into the interval records of a HistTable
+class HistBuilder:
+
+    def __init__(self):
+        self.times = []
+        self.closed = []  # (start, mask, asn, valid_from, valid_to)
+        self.open = {}    # (start, mask) -> (asn, valid_from)
+
+    # continues an existing history file
+    @classmethod
+    def load(cls, path):
+        b = cls()
+        h = HistTable(path)
+        try:
+            b.times = list(h.times)
+            for i in xrange(len(h)):
+                start, mask, asn, f, to = h[i]
+                if to == OPEN:
+                    b.open[start, mask] = (asn, f)
+                else:
+                    b.closed.append((start, mask, asn, f, to))
+        finally:
+            h.close()
+        return b
+
+    # entries: (start, mask, asn) of the snapshot taken at unix time t
+    def add(self, t, entries):
+        if self.times and t <= self.times[-1]:
+            raise Exception('snapshot %s is not newer than %s' % (format_time(t), format_time(self.times[-1])))
+        i = len(self.times)
+        self.times.append(t)
+
+        cur = dict(((start, mask), asn) for start, mask, asn in entries)
+        for k, (asn, f) in self.open.items():
+            if cur.get(k) != asn:
+                self.closed.append(k + (asn, f, i))
+                del self.open[k]
+
+        for k, asn in cur.iteritems():
+            if k not in self.open:
+                self.open[k] = (asn, i)
+
+    # written under a temporary name and renamed into place, as ipasndat.write_bin()
+    def write(self, path):
+        records = self.closed + [k + (asn, f, OPEN) for k, (asn, f) in self.open.iteritems()]
+        records.sort(key=lambda r: (r[0], r[1], r[3]))
+
+        cols = [array.array('I') for i in range(4)]  # starts, asns, valid_from, valid_to
+        masks = array.array('B')
+        assert cols[0].itemsize == 4
+        lengths = 0
+        for start, mask, asn, f, to in records:
+            cols[0].append(start)
+            cols[1].append(asn)
+            cols[2].append(f)
+            cols[3].append(to)
+            masks.append(mask)
+            lengths |= 1 << mask
+
+        times = array.array('I', self.times)
+        count = len(records)
+        masks.extend([0] * (-count % 4))
+
+        if sys.byteorder != 'little':
+            for a in cols + [times]:
+                a.byteswap()
+
+        tmp = '%s.tmp%d' % (path, os.getpid())
+        fw = open(tmp, 'wb')
+        try:
+            fw.write(_HDR.pack(MAGIC, VERSION, len(self.times), count, lengths))
+            times.tofile(fw)
+            for a in cols:
+                a.tofile(fw)
+            masks.tofile(fw)
+        finally:
+            fw.close()
+        os.rename(tmp, path)
+        return count
+
+
+
+# [(time, path)] of ipasndat/IPASNBIN files, ordered by the time in their names
+def snapshot_files(paths):
+    l = []
+    for path in paths:
+        t = parse_time(os.path.basename(path))
+        if t is None:
+            raise Exception('%s: no YYYYMMDD[.HHMM] snapshot time in the file name' % path)
+        l.append((t, path))
+    return sorted(l)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP-ASN history store (see ipasnhist.py)')
+    sub = parser.add_subparsers(dest='cmd')
+
+    p = sub.add_parser('build', help='create a history file from ipasndat snapshots')
+    p.add_argument('hist_file')
+    p.add_argument('files', nargs='+')
+
+    p = sub.add_parser('add', help='append newer ipasndat snapshots to a history file')
+    p.add_argument('hist_file')
+    p.add_argument('files', nargs='+')
+
+    p = sub.add_parser('lookup', help='origin asn of ips at a point in time')
+    p.add_argument('hist_file')
+    p.add_argument('when', metavar='YYYYMMDD[.HHMM]')
+    p.add_argument('ips', nargs='+')
+
+    p = sub.add_parser('history', help='origin asn of an ip over time')
+    p.add_argument('hist_file')
+    p.add_argument('ip')
+    p.add_argument('since', nargs='?', metavar='YYYYMMDD[.HHMM]')
+    p.add_argument('until', nargs='?', metavar='YYYYMMDD[.HHMM]')
+
+    p = sub.add_parser('info', help='snapshots and record count of a history file')
+    p.add_argument('hist_file')
+    args = parser.parse_args()
+
+    if args.cmd in ('build', 'add'):
+        st = time.time()
+        b = HistBuilder.load(args.hist_file) if args.cmd == 'add' else HistBuilder()
+        for t, path in snapshot_files(args.files):
+            b.add(t, asnlookup.read_entries(path))
+            print 'Added %s (%s): %d open, %d closed records' % (path, format_time(t), len(b.open), len(b.closed))
+        n = b.write(args.hist_file)
+        print 'IPASNHIS file saved (%d snapshots, %d records) in %.1fs' % (len(b.times), n, time.time()-st)
+        return
+
+    h = HistTable(args.hist_file)
+
+    if args.cmd == 'info':
+        print '%s: %d snapshots, %d records' % (args.hist_file, h.snapshots, len(h))
+        for t in h.times:
+            print format_time(t)
+
+    elif args.cmd == 'lookup':
+        t = parse_time(args.when)
+        for ip in args.ips:
+            r = h.match(ip, t)
+            print '%s\t%s' % (ip, '%d\t%s/%d' % (r[2], ipasndat.int_to_ip(r[0]), r[1]) if r else 'NA')
+
+    else:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until) if args.until else None
+        for f, to, start, mask, asn in h.history(args.ip, since, until):
+            print '%s\t%s\t%d\t%s/%d' % (format_time(f), format_time(to) if to is not None else '-',
+                                        asn, ipasndat.int_to_ip(start), mask)
+
+    h.close()
+
+
+if __name__ == '__main__':
+    main()
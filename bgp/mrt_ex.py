@@ -4,23 +4,98 @@
 # note: parts of this code are copied/based on the dpkt project
 # date 24.11.2009 v 1.1    , 02-12-2009 v1.2
 
-# note: this module might be speeded up by replacing some struct.unpacks with ord()
+# note: records are decoded in place with precompiled struct.Struct unpackers and
+#       explicit offsets into the record buffer; nothing re-slices the remainder of
+#       a record, so decoding cost is linear in the record length
 
 
+import socket
 import struct
 
 TABLE_DUMP_V1 = 12
 TABLE_DUMP_V2 = 13
+BGP4MP = 16
+BGP4MP_ET = 17
 
 AS32_SIZE = pow(2,16)
 
 
+# precompiled unpackers, shared by all classes below
+_MRT_HDR = struct.Struct('>IHHI')
+_TD1_HDR = struct.Struct('>HHIBBIIHH')
+_TD2_HDR = struct.Struct('>IB')
+_TDE_HDR = struct.Struct('>HIH')
+_PIT_HDR = struct.Struct('>IH')
+_PEER_HDR = struct.Struct('>BI')
+_ATTR_HDR = struct.Struct('>BB')   # also used for as_path segment headers
+_ATTR_HDR3 = struct.Struct('>BBB') # flags, type, 1 byte length
+_U8 = struct.Struct('B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_U128 = struct.Struct('>QQ')
+_PREFIX4 = [struct.Struct('>%dB' % n) for n in range(5)]  # by octet count
+_OCTET_MASK = [0, 0xff000000, 0xffff0000, 0xffffff00, 0xffffffff]
+_BGP4MP_HDR = struct.Struct('>HHHH')
+_BGP4MP_HDR_AS4 = struct.Struct('>IIHH')
+_BGP_HDR = struct.Struct('>16sHB')
+
+# as_path segment unpackers by (asn size, asn count), built on first use
+_SEGMENT = {}
+
+
+def _segment_struct(aslen, count):
+    k = (aslen, count)
+    st = _SEGMENT.get(k)
+    if st is None:
+        st = _SEGMENT[k] = struct.Struct('>%d%s' % (count, 'I' if aslen == 4 else 'H'))
+    return st
+
+
+def _cidr(prefix):
+    return '%d.%d.%d.%d' % (prefix>>24&0xff, prefix>>16&0xff, prefix>>8&0xff, prefix&0xff)
+
+
+def _cidr6(prefix):
+    return socket.inet_ntop(socket.AF_INET6, _U128.pack(prefix >> 64, prefix & 0xffffffffffffffff))
+
+
+# decodes the ipv4 nlri prefix at buf[px:]; returns (prefix, bitmask, next px)
+# with prefix an int, as in TableDump
+def _prefix4(buf, px):
+    bitmask = _U8.unpack_from(buf, px)[0]
+    octets = min((bitmask + 7) // 8, 4)
+    prefix = 0
+    for o in _PREFIX4[octets].unpack_from(buf, px + 1):
+        prefix = prefix << 8 | o
+    return prefix << 8 * (4 - octets), bitmask, px + 1 + octets
+
+
+# walks the path attributes in buf[off:end] by their flags and lengths alone,
+# and builds Attribute objects only for the type codes in types (all if None).
+# callers that need one attribute, as the converters do with AS_PATH, so pay
+# for a single Attribute per entry.
+def scan_attrs(buf, is32, off, end, types=None):
+    unpack_from = _ATTR_HDR3.unpack_from
+    px = off
+    l = []
+    while px < end:
+        flags, type, n = unpack_from(buf, px)
+        if types is None or type in types:
+            l.append(Attribute(buf, is32, px))
+        if flags & 0x10:  # extended length
+            px += 4 + _U16.unpack_from(buf, px + 2)[0]
+        else:
+            px += 3 + n
+    assert px == end
+    return l
+
+
 class MRTHeader2:
 
     HDR_LEN = 12
     
     def __init__(self, buf):
-        self.ts, self.type, self.subtype, self.len = struct.unpack('>IHHI', buf[0:12])
+        self.ts, self.type, self.subtype, self.len = _MRT_HDR.unpack_from(buf)
         self.data = buf[12:]
 
     def __str__(self):
@@ -31,29 +106,139 @@ class MRTHeader2:
 
 
 
+# yields an MRTRecord for every record read from file object f.
+# types restricts the records returned; its items are either record types
+# (TABLE_DUMP_V2) or (type, subtype) pairs. records that do not match are
+# skipped by their length without being decoded.
+def iter_records(f, types=None):
+    if types is not None:
+        types = frozenset(types)
+
+    read = f.read
+    hdr_len = MRTHeader2.HDR_LEN
+    while True:
+        s = read(hdr_len)
+        if len(s) == 0:
+            break
+        assert len(s) == hdr_len # truncated MRT header
+
+        ts, type, subtype, length = _MRT_HDR.unpack(s)
+        if types is not None and type not in types and (type, subtype) not in types:
+            _skip(f, length)
+            continue
+
+        s = read(length)
+        assert len(s) == length # truncated MRT record
+        yield MRTRecord(ts, type, subtype, s)
+
+
+# yields strings of about chunk_size bytes (more if a record is larger), each
+# holding only whole MRT records; used to hand the stream to worker processes.
+# the records themselves are not decoded, only their lengths are read.
+def iter_chunks(f, chunk_size=4<<20):
+    hdr_len = MRTHeader2.HDR_LEN
+    buf = ''
+    px = 0  # end of the last whole record found in buf
+    while True:
+        s = f.read(chunk_size)
+        buf += s
+        n = len(buf)
+        while px + hdr_len <= n:
+            end = px + hdr_len + _MRT_HDR.unpack_from(buf, px)[3]
+            if end > n:
+                break
+            px = end
+
+        if len(s) == 0:
+            assert px == n # truncated MRT record
+            if n:
+                yield buf
+            break
+
+        if px >= chunk_size:
+            yield buf[:px]
+            buf = buf[px:]
+            px = 0
+
+
+def _skip(f, n):
+    try:
+        f.seek(n, 1)
+    except (AttributeError, IOError):
+        # pipes and other unseekable streams
+        while n > 0:
+            n -= len(f.read(min(n, 65536)))
+
+
+
+# one MRT record as returned by iter_records(). only the common header is
+# decoded up front; the body is decoded the first time one of its fields
+# (cidr, entries, peers, ...) is accessed, and the attributes of each RIB entry
+# only when that entry's as_path() is used.
+class MRTRecord:
+
+    def __init__(self, ts, type, subtype, data):
+        self.ts, self.type, self.subtype, self.len = ts, type, subtype, len(data)
+        self.data = data
+        self._body = None
+
+    def body(self):
+        if self._body is None:
+            if self.type == TABLE_DUMP_V2 and self.subtype == TableDumpV2.RIB_IPV4_UNICAST:
+                self._body = TableDumpV2(self.data, lazy=True)
+            elif self.type == TABLE_DUMP_V2 and self.subtype == TableDumpV2.RIB_IPV6_UNICAST:
+                self._body = TableDumpV2(self.data, lazy=True, ipv6=True)
+            elif self.type == TABLE_DUMP_V2 and self.subtype == TableDumpV2.PEER_INDEX_TABLE:
+                self._body = PeerIndexTable(self.data)
+            elif self.type == TABLE_DUMP_V1:
+                self._body = TableDumpV1(self.data)
+            elif self.type == BGP4MP or self.type == BGP4MP_ET:
+                self._body = BGP4MPMessage(self.data, self.subtype, self.type == BGP4MP_ET)
+            else:
+                raise ValueError('cannot decode MRT record type %d subtype %d' % (self.type, self.subtype))
+        return self._body
+
+    def __getattr__(self, name):
+        # only called for fields that are not set in __init__, i.e. body fields
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.body(), name)
+
+    def __str__(self):
+        return 'mrt_{ts:%d,type:%d,subtype:%d,len:%d}'% (self.ts, self.type, self.subtype, self.len)
+
+    def __repr__(self):
+        return str(self)
+
+
+
 class TableDumpV1:
 
+    ipv6 = False # only AFI_IPv4 subtypes are decoded
+
     def __init__(self, buf):
-        self.view, self.seq, prefix, self.bitmask, self.status, self.originate_ts, self.peer_ip, self.peer_as, self.attr_len\
-                   = struct.unpack('>HHIBBIIHH', buf[:22])
+        self.view, self.seq, self.prefix, self.bitmask, self.status, self.originate_ts, self.peer_ip, self.peer_as, self.attr_len\
+                   = _TD1_HDR.unpack_from(buf)
 
         assert self.view == 0 # not necessary but in our data is so
         assert self.status == 1
 
-        self.cidr = '%d.%d.%d.%d' % (prefix>>24&0xff, prefix>>16&0xff, prefix>>8&0xff, prefix&0xff)
-        self.data = buf[22:]
+        self._buf = buf   # attributes start at offset 22
 
         self.attrs = None
 
 
+    # the prefix as an int is what the converter uses; the dotted form is built on demand
+    def _get_cidr(self):
+        return _cidr(self.prefix)
+    cidr = property(_get_cidr)
+
+
     def as_path(self):
-        self.parse_attrs()
-        
         as_path = None
-        for x in self.attrs:
-            if x.type == Attribute.AS_PATH:
-                assert as_path is None # "two aspaths"
-                as_path = x.as_path
+        for x in self.scan_attrs(Attribute.AS_PATH_ONLY):
+            assert as_path is None # "two aspaths"
+            as_path = x.as_path
 
         assert as_path is not None # no as path?
         return as_path
@@ -61,18 +246,15 @@ class TableDumpV1:
     def parse_attrs(self):
         if self.attrs is not None:
             return
-        
-        plen = self.attr_len
-        l = []
-        while plen > 0:
-            attr = Attribute(self.data, False)
-            self.data = self.data[len(attr):]
-            plen -= len(attr)
-            l.append(attr)
-        #
-        assert len(self.data) == 0        
-        self.attrs = l
-        
+        self.attrs = self.scan_attrs()
+
+    # the attributes whose type is in types (all if None); see scan_attrs()
+    def scan_attrs(self, types=None):
+        if self.attrs is not None:
+            return [x for x in self.attrs if types is None or x.type in types]
+        assert 22 + self.attr_len == len(self._buf)
+        return scan_attrs(self._buf, False, 22, 22 + self.attr_len, types)
+
 
     def __str__(self):
         return 'TableDumpV1{seq:%d,cidr:%s,bitmask:%d,attr_len:%d,peer_as:%d,status:%d,originate_ts:%d}' % \
@@ -88,47 +270,55 @@ class TableDumpV2:
     # TABLE_DUMP_V2 subtypes used:
     PEER_INDEX_TABLE = 1
     RIB_IPV4_UNICAST = 2
+    RIB_IPV6_UNICAST = 4
 
     PARSE_ONLY_FIRST_TDENTRY = True # !!! for speedup, as we only use the path on the first one
 
 
-    def __init__(self, buf):
-        self.seq, self.bitmask = struct.unpack('>IB', buf[0:5])
-
-        octets = (self.bitmask + 7) / 8
-        if octets == 0:
-            self.cidr = '0.0.0.0'
-            px = 5
-        elif octets == 1:
-            self.cidr = '%d.0.0.0' % ord(buf[5])
-            px = 6
-        elif octets == 2:
-            self.cidr = '%d.%d.0.0' % tuple(map(ord, buf[5:7]))
-            px = 7
-        elif octets == 3:
-            self.cidr = '%d.%d.%d.0' % tuple(map(ord, buf[5:8]))
-            px = 8
+    # lazy: parse no attributes up front; each entry decodes them on first use
+    # ipv6: a RIB_IPV6_UNICAST record; prefix is then a 128 bit int
+    def __init__(self, buf, lazy=False, ipv6=False):
+        self.seq, self.bitmask = _TD2_HDR.unpack_from(buf)
+        self.ipv6 = ipv6
+
+        # an ipv4 prefix is read as one 4 byte int and masked to its octets;
+        # only records too short for that (no entries) take the per-octet path
+        if ipv6:
+            octets = min((self.bitmask + 7) // 8, 16)
+            hi, lo = _U128.unpack((buf[5:5+octets] + '\0' * 16)[:16])
+            self.prefix = hi << 64 | lo
+        elif len(buf) >= 9:
+            octets = min((self.bitmask + 7) // 8, 4)
+            self.prefix = _U32.unpack_from(buf, 5)[0] & _OCTET_MASK[octets]
         else:
-            self.cidr = '%d.%d.%d.%d' % tuple(map(ord, buf[5:9]))
-            px = 9
+            octets = min((self.bitmask + 7) // 8, 4)
+            self.prefix = 0
+            for o in _PREFIX4[octets].unpack_from(buf, 5):
+                self.prefix = self.prefix << 8 | o
+            self.prefix <<= 8 * (4 - octets)
+        px = 5 + octets
         
-        self.entry_count = struct.unpack('>H', buf[px:px+2])[0]
-        buf = buf[px+2:]
+        self.entry_count = _U16.unpack_from(buf, px)[0]
+        px += 2
 
-        f_parseattrs = True
-        f_parseattrs_2nd = not self.PARSE_ONLY_FIRST_TDENTRY
+        f_parseattrs = not lazy
+        f_parseattrs_2nd = not (self.PARSE_ONLY_FIRST_TDENTRY or lazy)
         
         self.entries = []
         for ix in range(self.entry_count,0,-1):
-            et = TDEntry(buf, f_parseattrs)
+            et = TDEntry(buf, f_parseattrs, px)
             self.entries.append(et)
             
-            buf = et.raw
-            et.raw = None
+            px = et.end
             f_parseattrs = f_parseattrs_2nd
         #
 
-        assert len(buf) == 0
+        assert px == len(buf)
+
+
+    def _get_cidr(self):
+        return _cidr6(self.prefix) if self.ipv6 else _cidr(self.prefix)
+    cidr = property(_get_cidr)
 
 
     def __str__(self):
@@ -139,27 +329,76 @@ class TableDumpV2:
 
 
 
+class PeerIndexTable:
 
+    # peer_type bits
+    PEER_IPV6 = 0x1
+    PEER_AS4  = 0x2
 
-class TDEntry:
-    def __init__(self, buf, f_parseattrs):
-        self.peer_index, self.originate_ts, self.attr_len = struct.unpack('>HIH', buf[0:8])
-        self.data = buf[8 : 8 + self.attr_len]
-        self.raw = buf[8+self.attr_len:]
-
-        plen = self.attr_len
+    def __init__(self, buf):
+        self.collector_id, view_len = _PIT_HDR.unpack_from(buf)
+        px = 6
+        self.view_name = buf[px:px+view_len]
+        px += view_len
+        self.peer_count = _U16.unpack_from(buf, px)[0]
+        px += 2
+
+        # peers[peer_index] = (peer_type, bgp_id, peer_ip, peer_as); peer_ip is
+        # an int for IPv4 peers and the raw 16 bytes for IPv6 peers
         l = []
+        for ix in range(self.peer_count):
+            peer_type, bgp_id = _PEER_HDR.unpack_from(buf, px)
+            px += 5
+            if peer_type & self.PEER_IPV6:
+                ip = buf[px:px+16]
+                px += 16
+            else:
+                ip = _U32.unpack_from(buf, px)[0]
+                px += 4
+            if peer_type & self.PEER_AS4:
+                asn = _U32.unpack_from(buf, px)[0]
+                px += 4
+            else:
+                asn = _U16.unpack_from(buf, px)[0]
+                px += 2
+            l.append((peer_type, bgp_id, ip, asn))
+        #
+
+        assert px == len(buf)
+        self.peers = l
+
+    def __str__(self):
+        return 'PeerIndexTable{collector_id:%d,view_name:%s,peer_count:%d}' % (self.collector_id, self.view_name, self.peer_count)
+
+    def __repr__(self):
+        return str(self)
 
+
+
+
+
+class TDEntry:
+    # decodes the entry starting at buf[off:]; self.end is the offset just past it
+    def __init__(self, buf, f_parseattrs, off=0):
+        self.peer_index, self.originate_ts, self.attr_len = _TDE_HDR.unpack_from(buf, off)
+        self._buf = buf
+        self._off = off + 8
+        self.end = self._off + self.attr_len
+
+        self.attrs = None
         if f_parseattrs:
-            while plen > 0:
-                attr = Attribute(self.data, True) 
-                self.data = self.data[len(attr):]
-                plen -= len(attr)
-                l.append(attr)
+            self.parse_attrs()
 
-            assert(plen == 0)
-        
-        self.attrs = l
+    def parse_attrs(self):
+        if self.attrs is not None:
+            return
+        self.attrs = self.scan_attrs()
+
+    # the attributes whose type is in types (all if None); see scan_attrs()
+    def scan_attrs(self, types=None):
+        if self.attrs is not None:
+            return [x for x in self.attrs if types is None or x.type in types]
+        return scan_attrs(self._buf, True, self._off, self.end, types)
 
     def __str__(self):
         return 'TDEntry{peer_index: %d, originate_ts: %d, attr_len: %d}' % (self.peer_index, self.originate_ts, self.attr_len)
@@ -169,20 +408,52 @@ class TDEntry:
 
     def as_path(self):
         as_path = None
-        for x in self.attrs:
-            if x.type == Attribute.AS_PATH:
-                assert as_path is None # "TDEntry.two aspaths"
-                as_path = x.as_path
+        for x in self.scan_attrs(Attribute.AS_PATH_ONLY):
+            assert as_path is None # "TDEntry.two aspaths"
+            as_path = x.as_path
 
         assert as_path is not None # "TDEntry.no aspaths"
         return as_path
 
+    # same as as_path().owning_asn(), but for the common single segment path
+    # the origin is read straight from the buffer without building any objects
+    def origin(self):
+        buf = self._buf
+        unpack_from = _ATTR_HDR3.unpack_from
+        px, end = self._off, self.end
+        path = None
+        while px < end:
+            flags, type, n = unpack_from(buf, px)
+            if flags & 0x10:
+                n = _U16.unpack_from(buf, px + 2)[0]
+                px += 4
+            else:
+                px += 3
+            if type == Attribute.AS_PATH:
+                assert path is None # "TDEntry.two aspaths"
+                path = px
+                path_end = px + n
+            px += n
+        assert px == end
+
+        if path is not None and path_end - path > 2:
+            count = _ATTR_HDR.unpack_from(buf, path)[1]
+            if count and path + 2 + 4 * count == path_end:
+                x = _U32.unpack_from(buf, path_end - 4)[0]
+                if x > AS32_SIZE:
+                    return '%d.%d' % (x>>16, x&0xffff)
+                return str(x)
+
+        return self.as_path().owning_asn()
+
 
 class Attribute:
 
     # attribute types we use
     AS_PATH				= 2
 
+    AS_PATH_ONLY = frozenset([AS_PATH])  # scan_attrs() projection of as_path()
+
 
     def _get_o(self):
         return (self.flags >> 7) & 0x1
@@ -209,22 +480,28 @@ class Attribute:
     extended_length = property(_get_e, _set_e)
 
 
-    def __init__(self, buf, is32):
-        self.flags, self.type = struct.unpack('>BB', buf[0:2])
-        self.data = buf[2:]
+    # the attribute value is not copied out of buf; .data slices it on demand
+    def _get_data(self):
+        return self._buf[self._start:self._end]
+    data = property(_get_data)
+
+
+    def __init__(self, buf, is32, off=0):
+        self.flags, self.type = _ATTR_HDR.unpack_from(buf, off)
     
         if self.extended_length:
-            self.len = struct.unpack('>H', self.data[:2])[0]
-            self.data = self.data[2:]
+            self.len = _U16.unpack_from(buf, off + 2)[0]
+            self._start = off + 4
         else:
-            self.len = struct.unpack('B', self.data[:1])[0]
-            self.data = self.data[1:]
+            self.len = _U8.unpack_from(buf, off + 2)[0]
+            self._start = off + 3
             
-        self.data = self.data[:self.len]
+        self._buf = buf
+        self._end = min(self._start + self.len, len(buf))
 
 
         if self.type == self.AS_PATH:
-                self.as_path = self.ASPath32(self.data, is32)
+                self.as_path = self.ASPath32(buf, is32, self._start, self._end)
 
         # We do not use the rest of the attributes, so I have not configured them for speed
         # stats on usage in TDv2 files(on approx 100.000 thousand):
@@ -239,7 +516,7 @@ class Attribute:
     
     def __len__(self):
         attr_len = 2 if self.extended_length else 1
-        return 2 + attr_len + len(self.data)
+        return 2 + attr_len + self._end - self._start
 
     def __str__(self):
         if self.extended_length:
@@ -247,7 +524,7 @@ class Attribute:
         else:
             attr_len_str = struct.pack('B', self.len)
 
-        return 'Attr2{type:%d,flags:%d,len(data):%d}' % (self.type, self.flags, len(self.data))
+        return 'Attr2{type:%d,flags:%d,len(data):%d}' % (self.type, self.flags, self._end - self._start)
 
     def __repr__(self):
         return str(self)
@@ -261,13 +538,13 @@ class Attribute:
         AS_SEQUENCE     = 2
 
             
-        def __init__(self, buf, is32):
-            self.segments = []
-            self.data = buf
+        def __init__(self, buf, is32, off=0, end=None):
+            if end is None:
+                end = len(buf)
             l = []
-            while self.data:
-                seg = self.ASPathSegment32(self.data, is32)
-                self.data = self.data[len(seg):]
+            while off < end:
+                seg = self.ASPathSegment32(buf, is32, off)
+                off += len(seg)
                 l.append(seg)
             self.data = self.segments = l
 
@@ -306,26 +583,16 @@ class Attribute:
             AS_SEQUENCE     = 2
 
             
-            def __init__(self, buf, is32):
-                self.type, self.len = struct.unpack('>BB', buf[:2])
-                self.data = buf[2:]
+            def __init__(self, buf, is32, off=0):
+                self.type, self.len = _ATTR_HDR.unpack_from(buf, off)
                 self.aslen = 4 if is32 else 2
 
                 #print self.type 
                 assert self.type==self.AS_SET or self.type==self.AS_SEQUENCE  or self.type==3  # 3!
                 # stats on 100,000: {1: 1196, 2: 3677845}
                 
-                l = []
-                for i in range(self.len):
-                    if is32:
-                        AS = struct.unpack('>I', self.data[:4])[0]
-                        self.data = self.data[4:]
-                    else:
-                        AS = struct.unpack('>H', self.data[:2])[0]
-                        self.data = self.data[2:]                        
-                    l.append(AS)
-                #    
-                self.data = self.path = l
+                # all asns of the segment in one unpack
+                self.data = self.path = list(_segment_struct(self.aslen, self.len).unpack_from(buf, off + 2))
                 
 
             def __len__(self):
@@ -346,4 +613,113 @@ class Attribute:
                 return str(self)
 
 
-    
+
+class BGP4MPMessage:
+
+    # BGP4MP subtypes used; the AS4 variants carry 4 byte asns throughout
+    MESSAGE = 1
+    MESSAGE_AS4 = 4
+    MESSAGE_LOCAL = 6
+    MESSAGE_AS4_LOCAL = 7
+
+    SUBTYPES = (MESSAGE, MESSAGE_AS4, MESSAGE_LOCAL, MESSAGE_AS4_LOCAL)
+
+    # BGP message types
+    UPDATE = 2
+
+    AFI_IPV4 = 1
+
+
+    # et: BGP4MP_ET record, whose body starts with a microsecond timestamp
+    def __init__(self, buf, subtype, et=False):
+        assert subtype in self.SUBTYPES # 'not a BGP4MP message'
+        px = 4 if et else 0
+        self.is32 = subtype in (self.MESSAGE_AS4, self.MESSAGE_AS4_LOCAL)
+
+        if self.is32:
+            self.peer_as, self.local_as, self.ifindex, self.afi = _BGP4MP_HDR_AS4.unpack_from(buf, px)
+            px += 12
+        else:
+            self.peer_as, self.local_as, self.ifindex, self.afi = _BGP4MP_HDR.unpack_from(buf, px)
+            px += 8
+
+        # peer_ip is an int for ipv4 sessions and the raw 16 bytes for ipv6
+        if self.afi == self.AFI_IPV4:
+            self.peer_ip = _U32.unpack_from(buf, px)[0]
+            px += 8
+        else:
+            self.peer_ip = buf[px:px+16]
+            px += 32
+
+        marker, self.msg_len, self.msg_type = _BGP_HDR.unpack_from(buf, px)
+        px += 19
+
+        self.update = None
+        if self.msg_type == self.UPDATE:
+            self.update = BGPUpdate(buf, self.is32, px, px - 19 + self.msg_len)
+
+    def __str__(self):
+        return 'BGP4MPMessage{peer_as:%d,afi:%d,msg_type:%d,msg_len:%d}' % (self.peer_as, self.afi, self.msg_type, self.msg_len)
+
+    def __repr__(self):
+        return str(self)
+
+
+
+# BGP UPDATE message body in buf[off:end]. withdrawn and announced hold the
+# ipv4 (prefix, bitmask) int pairs, as TableDump has them; attributes are parsed
+# on first use, as in TDEntry
+class BGPUpdate:
+
+    def __init__(self, buf, is32, off, end):
+        self._buf = buf
+        self._is32 = is32
+
+        px = off
+        wd_end = px + 2 + _U16.unpack_from(buf, px)[0]
+        px += 2
+        l = []
+        while px < wd_end:
+            prefix, bitmask, px = _prefix4(buf, px)
+            l.append((prefix, bitmask))
+        assert px == wd_end
+        self.withdrawn = l
+
+        self.attr_len = _U16.unpack_from(buf, px)[0]
+        self._off = px + 2
+        self._end = self._off + self.attr_len
+
+        px = self._end
+        l = []
+        while px < end:
+            prefix, bitmask, px = _prefix4(buf, px)
+            l.append((prefix, bitmask))
+        assert px == end
+        self.announced = l
+
+        self.attrs = None
+
+    def parse_attrs(self):
+        if self.attrs is not None:
+            return
+        self.attrs = self.scan_attrs()
+
+    # the attributes whose type is in types (all if None); see scan_attrs()
+    def scan_attrs(self, types=None):
+        if self.attrs is not None:
+            return [x for x in self.attrs if types is None or x.type in types]
+        return scan_attrs(self._buf, self._is32, self._off, self._end, types)
+
+    # None for pure withdrawals
+    def as_path(self):
+        as_path = None
+        for x in self.scan_attrs(Attribute.AS_PATH_ONLY):
+            assert as_path is None # "BGPUpdate.two aspaths"
+            as_path = x.as_path
+        return as_path
+
+    def __str__(self):
+        return 'BGPUpdate{withdrawn:%d,announced:%d,attr_len:%d}' % (len(self.withdrawn), len(self.announced), self.attr_len)
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+# columnar export of every unicast RIB entry of an MRT dump, for analysis
+# without re-parsing the MRT: one row per (prefix, peer) with its originate
+# time, AS path and origin, where convert_rib.py keeps only the first origin.
+#
+# the output directory holds NumPy .npz files (zip archives of .npy arrays,
+# deflate compressed as numpy.savez_compressed writes them), written without
+# numpy itself:
+#
+#   rows-00000.npz ...   at most --rows rows each, one array per column:
+#     seq            <u4   record sequence number
+#     prefix         <u4   ipv4 prefix start address
+#     mask           u1    prefix length
+#     peer           <u2   row of peers.npz
+#     originate_ts   <u4   unix time the route was received
+#     origin         <u4   origin asn of a plain AS_SEQUENCE path, else 0
+#     has_origin     u1    1 when origin is set, 0 for AS_SET, AS_CONFED,
+#                          multi-segment and empty paths
+#     path_offsets   <u4   rows + 1 offsets into path_asns: row i's path is
+#     path_asns      <u4   path_asns[path_offsets[i]:path_offsets[i+1]]
+#                          (the Arrow list<uint32> layout; AS_SET members are
+#                          included in order)
+#     path_set       u1    1 when the path has an AS_SET or AS_CONFED segment
+#
+#   peers.npz            peer_ip |V16 (raw 16 bytes, ipv4 as ::ffff:a.b.c.d;
+#                        void rather than |S16, which drops trailing NULs),
+#                        peer_as <u4, peer_bgp_id <u4; TABLE_DUMP_V2 peer
+#                        index order, or order of first appearance for
+#                        TABLE_DUMP dumps
+#
+#   rows6-00000.npz ...  the ipv6 unicast entries (TABLE_DUMP_V2 only), with
+#                        the same columns but prefix |V16 (the 16 raw bytes,
+#                        network order)
+#
+#   d = numpy.load('out/rows-00000.npz'); d['origin'], d['path_asns'], ...
+#
+# rows-*.npz and rows6-*.npz files of an earlier export to the same directory
+# are removed first. TABLE_DUMP ipv6 records are not decoded by mrt_ex.py and
+# stop the export with an error rather than being left out.
+
+import argparse
+import array
+import os
+import struct
+import sys
+import time
+import zipfile
+
+import convert_rib
+import mrt_ex
+import rib_input
+
+
+ROWS = 1 << 20
+
+# (name, array typecode, npy descr) of the per-row columns
+COLUMNS = [
+    ('seq',          'I', '<u4'),
+    ('prefix',       'I', '<u4'),
+    ('mask',         'B', '|u1'),
+    ('peer',         'H', '<u2'),
+    ('originate_ts', 'I', '<u4'),
+    ('origin',       'I', '<u4'),
+    ('has_origin',   'B', '|u1'),
+    ('path_set',     'B', '|u1'),
+]
+
+_PREFIX6 = struct.Struct('>QQ')
+
+_NPY_MAGIC = '\x93NUMPY\x01\x00'
+
+
+
+# the .npy encoding (format version 1.0) of the 1-d array data, given as raw
+# little endian bytes
+def npy_bytes(data, descr, count):
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, count)
+    # numpy pads the header so the data starts 64 byte aligned
+    header += ' ' * (-(len(_NPY_MAGIC) + 2 + len(header) + 1) % 64) + '\n'
+    return _NPY_MAGIC + struct.pack('<H', len(header)) + header + data
+
+
+# writes {name: (data, descr, count)} to an .npz file, atomically
+def write_npz(path, arrays):
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    zf = zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    try:
+        for name in sorted(arrays):
+            data, descr, count = arrays[name]
+            zf.writestr(name + '.npy', npy_bytes(data, descr, count))
+    finally:
+        zf.close()
+    os.rename(tmp, path)
+
+
+def _raw(a):
+    if sys.byteorder != 'little' and a.itemsize > 1:
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+
+
+# ipv6: writes rows6-*.npz files with 16 byte prefixes
+class ColumnWriter:
+
+    def __init__(self, out_dir, rows=ROWS, ipv6=False):
+        self.out_dir = out_dir
+        self.rows = rows
+        self.ipv6 = ipv6
+        self.files = 0
+        self.total = 0
+        self._reset()
+
+    def _reset(self):
+        self.cols = dict((name, array.array(tc)) for name, tc, descr in COLUMNS)
+        self.prefix6 = bytearray()
+        self.path_offsets = array.array('I', [0])
+        self.path_asns = array.array('I')
+
+    # segments: the ASPath32 segments of the row's path
+    def add(self, seq, prefix, mask, peer, originate_ts, segments):
+        c = self.cols
+        c['seq'].append(seq)
+        if self.ipv6:
+            self.prefix6 += _PREFIX6.pack(prefix >> 64, prefix & 0xffffffffffffffff)
+        else:
+            c['prefix'].append(prefix)
+        c['mask'].append(mask)
+        c['peer'].append(peer)
+        c['originate_ts'].append(originate_ts)
+
+        path_set = 0
+        for seg in segments:
+            self.path_asns.extend(seg.path)
+            if seg.type != seg.AS_SEQUENCE:
+                path_set = 1
+        self.path_offsets.append(len(self.path_asns))
+        c['path_set'].append(path_set)
+
+        origin = has_origin = 0
+        if len(segments) == 1 and not path_set and segments[0].path:
+            origin, has_origin = segments[0].path[-1], 1
+        c['origin'].append(origin)
+        c['has_origin'].append(has_origin)
+
+        if len(c['seq']) >= self.rows:
+            self.flush()
+
+    def flush(self):
+        n = len(self.cols['seq'])
+        if not n:
+            return
+        arrays = dict((name, (_raw(self.cols[name]), descr, n)) for name, tc, descr in COLUMNS)
+        if self.ipv6:
+            arrays['prefix'] = (str(self.prefix6), '|V16', n)
+        arrays['path_offsets'] = (_raw(self.path_offsets), '<u4', n + 1)
+        arrays['path_asns'] = (_raw(self.path_asns), '<u4', len(self.path_asns))
+        name = 'rows6-%05d.npz' if self.ipv6 else 'rows-%05d.npz'
+        write_npz(os.path.join(self.out_dir, name % self.files), arrays)
+
+        self.files += 1
+        self.total += n
+        self._reset()
+
+    # peers: [(peer_ip, peer_as, bgp_id)] with peer_ip an int or 16 raw bytes
+    def write_peers(self, peers):
+        ips = ''.join(ip if isinstance(ip, str) else '\0' * 10 + '\xff\xff' + struct.pack('>I', ip)
+                      for ip, asn, bgp_id in peers)
+        arrays = {
+            'peer_ip': (ips, '|V16', len(peers)),
+            'peer_as': (_raw(array.array('I', [asn for ip, asn, bgp_id in peers])), '<u4', len(peers)),
+            'peer_bgp_id': (_raw(array.array('I', [bgp_id for ip, asn, bgp_id in peers])), '<u4', len(peers)),
+        }
+        write_npz(os.path.join(self.out_dir, 'peers.npz'), arrays)
+
+
+
+# exports every unicast RIB entry of MRT file object f; returns (records, rows)
+def export(f, out_dir, rows=ROWS):
+    for name in os.listdir(out_dir):
+        if name.startswith(('rows-', 'rows6-')) and name.endswith('.npz'):
+            os.remove(os.path.join(out_dir, name))
+
+    w = ColumnWriter(out_dir, rows)
+    w6 = ColumnWriter(out_dir, rows, ipv6=True)
+    peers = []
+    peer_ids = {}  # TABLE_DUMP: (peer_ip, peer_as) -> peer row
+    nn = 0
+
+    types = [(mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.PEER_INDEX_TABLE),
+             (mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.RIB_IPV4_UNICAST),
+             (mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.RIB_IPV6_UNICAST),
+             (mrt_ex.TABLE_DUMP_V1, 1),
+             (mrt_ex.TABLE_DUMP_V1, 2)]
+
+    for rec in mrt_ex.iter_records(f, types):
+        if rec.type == mrt_ex.TABLE_DUMP_V1 and rec.subtype == 2:
+            raise Exception('TABLE_DUMP ipv6 records are not supported')
+
+        body = rec.body()
+        if rec.type == mrt_ex.TABLE_DUMP_V2 and rec.subtype == mrt_ex.TableDumpV2.PEER_INDEX_TABLE:
+            peers = [(ip, asn, bgp_id) for peer_type, bgp_id, ip, asn in body.peers]
+            continue
+
+        nn += 1
+        convert_rib.progress(nn, 2 if rec.type == mrt_ex.TABLE_DUMP_V2 else 1)
+
+        if rec.type == mrt_ex.TABLE_DUMP_V1:
+            k = (body.peer_ip, body.peer_as)
+            peer = peer_ids.get(k)
+            if peer is None:
+                peer = peer_ids[k] = len(peers)
+                peers.append((body.peer_ip, body.peer_as, 0))
+            w.add(body.seq, body.prefix, body.bitmask, peer, body.originate_ts, body.as_path().segments)
+        else:
+            wr = w6 if body.ipv6 else w
+            for e in body.entries:
+                wr.add(body.seq, body.prefix, body.bitmask, e.peer_index, e.originate_ts, e.as_path().segments)
+    #
+
+    w.flush()
+    w6.flush()
+    w.write_peers(peers)
+    return nn, w.total + w6.total
+
+
+
+def main():
+    print 'MRT RIB columnar exporter v1.0.'
+
+    parser = argparse.ArgumentParser(
+        usage='mrt_export.py  [--rows N]  [--decompress MODE]   <ribmrtdump_file.bz2>   <out_dir>'
+    )
+    parser.add_argument('dump_file')
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=ROWS, metavar='N',
+        help='rows per .npz file (default %(default)s)')
+    parser.add_argument('--decompress', default='builtin', metavar='MODE',
+        help='decompression mode, as in convert_rib.py')
+    args = parser.parse_args()
+
+    st = time.time()
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    f = rib_input.open_dump(args.dump_file, args.decompress)
+    try:
+        nn, rows = export(f, args.out_dir, args.rows)
+    finally:
+        f.close()
+
+    print '\nExported %d records as %d rows to %s in %.1fs' % (nn, rows, args.out_dir, time.time()-st)
+
+
+if __name__ == '__main__':
+    main()
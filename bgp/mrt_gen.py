@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+# synthetic MRT RIB dump generator, for testing and benchmarking mrt_ex.py and
+# convert_rib.py without downloading a real routeviews RIB.
+#
+# writes TABLE_DUMP (v1) or TABLE_DUMP_V2 dumps with random, non-overlapping
+# seq numbers and prefixes, a configurable number of peers per prefix and
+# AS paths of configurable length (with some prepending and AS_SETs)
+
+import argparse
+import bz2
+import random
+import struct
+
+import mrt_ex
+
+
+# prefix length distribution, roughly that of a full ipv4 table
+IPV4_LENGTHS = [8, 12, 16, 16, 19, 20, 21, 22, 22, 23, 23] + [24] * 25
+IPV6_LENGTHS = [29, 32, 32, 36, 40, 44, 48, 48, 48, 48, 64]
+
+_MRT_HDR = struct.Struct('>IHHI')
+
+
+
+class RibGenerator:
+
+    def __init__(self, prefixes=10000, peers=8, path_len=(2, 8), ipv6=0, as4=0.3, seed=1, ts=1259126400):
+        self.prefixes = prefixes
+        self.peers = peers
+        self.path_len = path_len
+        self.ipv6 = ipv6
+        self.as4 = as4
+        self.ts = ts
+        self.rnd = random.Random(seed)
+
+    # sorted, distinct (prefix, bitmask) pairs; bits is 32 or 128
+    def gen_prefixes(self, n, bits, lengths):
+        rnd = self.rnd
+        seen = set()
+        while len(seen) < n:
+            m = rnd.choice(lengths)
+            seen.add((rnd.getrandbits(m) << (bits - m) if m else 0, m))
+        return sorted(seen)
+
+    def as_path(self, is32):
+        rnd = self.rnd
+        top = 400000 if is32 and rnd.random() < self.as4 else 65000
+        path = [rnd.randint(1, top) for i in range(rnd.randint(*self.path_len))]
+        if rnd.random() < 0.2:
+            path += [path[-1]] * rnd.randint(1, 4)  # prepending
+
+        fmt = '>I' if is32 else '>H'
+        segs = [(2, path)]
+        if rnd.random() < 0.01:
+            segs.append((1, [rnd.randint(1, 65000) for i in range(3)]))
+
+        return ''.join(struct.pack('>BB', t, len(l)) + ''.join(struct.pack(fmt, a) for a in l) for t, l in segs)
+
+    # ORIGIN, AS_PATH, NEXT_HOP and sometimes MULTI_EXIT_DISC and COMMUNITIES
+    def attrs(self, is32):
+        rnd = self.rnd
+        l = [(0x40, 1, '\x00'), (0x40, 2, self.as_path(is32)), (0x40, 3, '\x0a\x00\x00\x01')]
+        if rnd.random() < 0.1:
+            l.append((0x80, 4, struct.pack('>I', rnd.randint(0, 1000))))
+        if rnd.random() < 0.15:
+            l.append((0xc0, 8, ''.join(struct.pack('>HH', rnd.randint(1, 65000), rnd.randint(1, 999)) for i in range(rnd.randint(1, 100)))))
+
+        s = ''
+        for flags, t, data in l:
+            if len(data) > 255:
+                s += struct.pack('>BBH', flags | 0x10, t, len(data)) + data
+            else:
+                s += struct.pack('>BBB', flags, t, len(data)) + data
+        return s
+
+    def record(self, type, subtype, body):
+        return _MRT_HDR.pack(self.ts, type, subtype, len(body)) + body
+
+    # yields the records of a TABLE_DUMP_V2 dump: the peer index table, the ipv4
+    # and then the ipv6 RIB entries, with one seq numbering throughout
+    def table_dump_v2(self):
+        body = struct.pack('>IHH', 0x0a000001, 0, self.peers)
+        for i in range(self.peers):
+            body += struct.pack('>BIII', 2, 0x0a000000 + i, 0x0a000000 + i, 64512 + i)
+        yield self.record(mrt_ex.TABLE_DUMP_V2, mrt_ex.TableDumpV2.PEER_INDEX_TABLE, body)
+
+        seq = 0
+        for subtype, bits, n, lengths in ((mrt_ex.TableDumpV2.RIB_IPV4_UNICAST, 32, self.prefixes, IPV4_LENGTHS),
+                                          (mrt_ex.TableDumpV2.RIB_IPV6_UNICAST, 128, self.ipv6, IPV6_LENGTHS)):
+            for prefix, bitmask in self.gen_prefixes(n, bits, lengths):
+                octets = (bitmask + 7) // 8
+                pb = ''.join(chr(prefix >> (bits - 8 * (i + 1)) & 0xff) for i in range(octets))
+                entries = self.rnd.sample(range(self.peers), self.rnd.randint(1, self.peers))
+
+                body = struct.pack('>IB', seq, bitmask) + pb + struct.pack('>H', len(entries))
+                for peer in entries:
+                    a = self.attrs(True)
+                    body += struct.pack('>HIH', peer, self.ts - 3600, len(a)) + a
+                yield self.record(mrt_ex.TABLE_DUMP_V2, subtype, body)
+                seq += 1
+
+    # yields the records of a TABLE_DUMP (v1) dump: one record per peer and prefix
+    def table_dump_v1(self):
+        seq = 0
+        for prefix, bitmask in self.gen_prefixes(self.prefixes, 32, IPV4_LENGTHS):
+            for peer in sorted(self.rnd.sample(range(self.peers), self.rnd.randint(1, self.peers))):
+                a = self.attrs(False)
+                body = struct.pack('>HHIBBIIHH', 0, seq, prefix, bitmask, 1, self.ts - 3600, 0x0a000000 + peer, 64512 + peer, len(a)) + a
+                yield self.record(mrt_ex.TABLE_DUMP_V1, 1, body)
+                seq = (seq + 1) % 65536
+
+    # writes the dump to path, bz2 compressed unless compress is False;
+    # returns (records, uncompressed bytes)
+    def write(self, path, tdv=2, compress=True):
+        f = bz2.BZ2File(path, 'wb') if compress else open(path, 'wb')
+        nn = size = 0
+        try:
+            for r in (self.table_dump_v2() if tdv == 2 else self.table_dump_v1()):
+                f.write(r)
+                nn += 1
+                size += len(r)
+        finally:
+            f.close()
+        return nn, size
+
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        usage='mrt_gen.py  [options]   <out_file>'
+    )
+    parser.add_argument('out_file')
+    parser.add_argument('-t', '--table-dump', type=int, choices=[1, 2], default=2,
+        help='TABLE_DUMP version to write')
+    parser.add_argument('-n', '--prefixes', type=int, default=10000, metavar='N',
+        help='ipv4 prefixes')
+    parser.add_argument('--ipv6', type=int, default=0, metavar='N',
+        help='ipv6 prefixes (TABLE_DUMP_V2 only)')
+    parser.add_argument('-p', '--peers', type=int, default=8, metavar='N',
+        help='maximum peers per prefix')
+    parser.add_argument('--path-len', default='2-8', metavar='MIN-MAX',
+        help='AS path length before prepending')
+    parser.add_argument('--as4', type=float, default=0.3, metavar='F',
+        help='fraction of TABLE_DUMP_V2 paths using 32 bit asns')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--raw', action='store_true',
+        help='do not bz2 compress the output')
+    args = parser.parse_args()
+
+    lo, hi = [int(x) for x in args.path_len.split('-')]
+    gen = RibGenerator(args.prefixes, args.peers, (lo, hi), args.ipv6, args.as4, args.seed)
+    nn, size = gen.write(args.out_file, args.table_dump, not args.raw)
+    print 'Wrote %s: TableDumpV%d, %d records, %.1f MB uncompressed' % (args.out_file, args.table_dump, nn, size / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# input layer for MRT dumps: opens bz2, gzip, xz or uncompressed files (by
+# their magic bytes) as a file object for mrt_ex.iter_records().
+#
+# decompression modes:
+#   builtin    decompress in the reading thread (bz2/gzip modules)
+#   thread     decompress in a background thread that feeds the parser through
+#              a bounded queue of blocks; the bz2 and zlib modules release the
+#              GIL while decompressing, so both overlap
+#   external   pipe the file through an external decompressor process, a
+#              parallel one (lbzip2, pbzip2, pigz) when installed
+#   any other mode string is used as the decompressor command itself, e.g.
+#   'lbzip2 -dc -n 4'; the file name is appended to it.
+#
+# python 2 has no lzma module, so xz files always go through 'xz -dc'.
+
+import bz2
+import distutils.spawn
+import gzip
+import Queue
+import subprocess
+import threading
+
+
+MODES = ('builtin', 'thread', 'external')
+
+# external decompressors per format, in order of preference
+EXTERNAL = {
+    'bz2':  [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+    'xz':   [['xz', '-dc']],
+}
+
+MAGIC = [
+    ('BZh', 'bz2'),
+    ('\x1f\x8b', 'gzip'),
+    ('\xfd7zXZ\x00', 'xz'),
+]
+
+BLOCK_SIZE = 1 << 20    # thread mode read size
+QUEUE_BLOCKS = 16       # thread mode buffer, in blocks
+
+
+
+def detect_format(path):
+    f = open(path, 'rb')
+    head = f.read(8)
+    f.close()
+    for magic, fmt in MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return 'raw'
+
+
+def external_command(fmt):
+    for cmd in EXTERNAL[fmt]:
+        if distutils.spawn.find_executable(cmd[0]):
+            return cmd
+    raise Exception('no external decompressor found for %s (tried %s)' % (fmt, ', '.join(c[0] for c in EXTERNAL[fmt])))
+
+
+def open_dump(path, mode='builtin'):
+    fmt = detect_format(path)
+    if fmt == 'raw':
+        return open(path, 'rb')
+
+    if mode not in MODES:
+        return ExternalReader(mode.split() + [path])
+
+    if mode == 'external' or fmt == 'xz':
+        return ExternalReader(external_command(fmt) + [path])
+
+    f = bz2.BZ2File(path, 'rb') if fmt == 'bz2' else gzip.GzipFile(path, 'rb')
+    if mode == 'thread':
+        return ThreadedReader(f)
+    return f
+
+
+# first n decompressed bytes of path
+def read_head(path, n, mode='builtin'):
+    f = open_dump(path, mode)
+    try:
+        return f.read(n)
+    finally:
+        f.close()
+
+
+
+# seek() of the readers below: forward only, by reading and dropping the data
+def _seek_forward(f, offset, whence):
+    if whence == 1:
+        offset += f.pos
+    elif whence != 0:
+        raise IOError('can only seek from the start or the current position')
+    if offset < f.pos:
+        raise IOError('cannot seek backwards in a decompressed stream')
+    while f.pos < offset:
+        if not f.read(min(offset - f.pos, BLOCK_SIZE)):
+            break
+
+
+
+# decompressed output of an external command, read from its stdout pipe
+class ExternalReader:
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.name = cmd[-1]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=BLOCK_SIZE)
+        self.pos = 0
+
+    def read(self, n=-1):
+        s = self.proc.stdout.read(n)
+        self.pos += len(s)
+        if not s or (n > 0 and len(s) < n):
+            self._check()
+        return s
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        _seek_forward(self, offset, whence)
+
+    # a decompressor that fails midway looks like a short file; don't let it
+    def _check(self):
+        rc = self.proc.wait()
+        if rc != 0:
+            raise Exception('%s exited with status %d' % (' '.join(self.cmd), rc))
+
+    def close(self):
+        if self.proc.returncode is None:
+            self.proc.stdout.close()
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+
+
+
+# reads file object f in a background thread, BLOCK_SIZE at a time, keeping
+# at most QUEUE_BLOCKS blocks buffered
+class ThreadedReader:
+
+    def __init__(self, f):
+        self.f = f
+        self.name = getattr(f, 'name', None)
+        self.q = Queue.Queue(QUEUE_BLOCKS)
+        self.buf = ''
+        self.bpos = 0
+        self.pos = 0
+        self.eof = False
+        self.stop = False
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.stop:
+                s = self.f.read(BLOCK_SIZE)
+                self.q.put(s)
+                if not s:
+                    break
+        except Exception, e:
+            self.q.put(e)
+
+    def _next_block(self):
+        s = self.q.get()
+        if isinstance(s, Exception):
+            raise s
+        if not s:
+            self.eof = True
+        self.buf, self.bpos = s, 0
+
+    def read(self, n=-1):
+        if n < 0:
+            n = 1 << 62
+
+        # fast path: the whole read is in the current block
+        if self.bpos + n <= len(self.buf):
+            s = self.buf[self.bpos:self.bpos+n]
+            self.bpos += n
+            self.pos += n
+            return s
+
+        l = []
+        while n > 0 and not self.eof:
+            if self.bpos >= len(self.buf):
+                self._next_block()
+                continue
+            s = self.buf[self.bpos:self.bpos+n]
+            self.bpos += len(s)
+            n -= len(s)
+            l.append(s)
+
+        s = ''.join(l)
+        self.pos += len(s)
+        return s
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        _seek_forward(self, offset, whence)
+
+    def close(self):
+        self.stop = True
+        while self.thread.is_alive():
+            try:
+                self.q.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        self.f.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+# applies MRT BGP4MP update dumps to an ipasndat file made by convert_rib.py,
+# so the table can be kept fresh between full RIB conversions.
+# file to use should be of these series:
+# http://archive.routeviews.org/bgpdata/2009.11/UPDATES/updates.20091125.0600.bz2
+#
+# update files are applied in the order given:
+#  - an announcement sets the prefix's origin asn (latest announcement wins;
+#    AS_SET and 32 bit origins drop it from the table, as in convert_rib.py)
+#  - a withdrawal removes the prefix once no peer seen in these updates still
+#    announces it. prefixes of the base table are kept (with their base origin)
+#    when withdrawn, since peers not seen in these updates may still carry
+#    them, unless --peer restricts the updates to a single peer, whose
+#    withdrawals then count.
+
+
+import argparse
+import time
+
+import asnlookup
+import convert_rib
+import ipasndat
+import mrt_ex
+import rib_input
+
+
+
+class UpdateTable:
+
+    # dat: {(prefix, bitmask): asn}, with the prefix as an int
+    def __init__(self, dat, authoritative=False):
+        self.dat = dat
+        self.base = dict(dat)  # the base table's origins, restored when a flap ends
+        self.authoritative = authoritative
+        self.peers = {}  # (prefix, bitmask) -> peers announcing it in these updates
+        self.announced = self.withdrawn = 0
+
+    def announce(self, k, peer, owner):
+        self.announced += 1
+        self.peers.setdefault(k, set()).add(peer)
+
+        if owner is not None and owner.isdigit():
+            self.dat[k] = int(owner)
+        else:
+            self.dat.pop(k, None)
+
+    def withdraw(self, k, peer):
+        self.withdrawn += 1
+        peers = self.peers.get(k)
+        if peers is not None:
+            peers.discard(peer)
+            if peers:
+                return
+            del self.peers[k]
+
+        if self.authoritative or k not in self.base:
+            self.dat.pop(k, None)
+        else:
+            self.dat[k] = self.base[k]
+
+    # (prefix, bitmask, asn) of the table, in numeric order
+    def entries(self):
+        return sorted(k + (asn,) for k, asn in self.dat.iteritems())
+
+    # applies every ipv4 UPDATE in the MRT file object f
+    def apply(self, f, peer_ip=None):
+        types = [(t, s) for t in (mrt_ex.BGP4MP, mrt_ex.BGP4MP_ET) for s in mrt_ex.BGP4MPMessage.SUBTYPES]
+        nn = 0
+
+        for rec in mrt_ex.iter_records(f, types):
+            msg = rec.body()
+            if msg.update is None or msg.afi != msg.AFI_IPV4:
+                continue
+            if peer_ip is not None and msg.peer_ip != peer_ip:
+                continue
+
+            nn += 1
+            upd = msg.update
+            peer = (msg.peer_as, msg.peer_ip)
+
+            for k in upd.withdrawn:
+                self.withdraw(k, peer)
+
+            if upd.announced:
+                owner = upd.as_path().owning_asn()
+                for k in upd.announced:
+                    self.announce(k, peer, owner)
+        #
+
+        return nn
+
+
+
+def main():
+    print 'MRT update importer v1.0.'
+
+    parser = argparse.ArgumentParser(
+        usage='update_rib.py  [--peer IP]  [-o FILE]  [--bin FILE]  [--decompress MODE]   <ipasndat_file>   <updates_file.bz2> ...'
+    )
+    parser.add_argument('ipasndat_file')
+    parser.add_argument('update_files', nargs='+')
+    parser.add_argument('--peer', metavar='IP',
+        help='only apply updates received from this peer; its withdrawals are authoritative')
+    parser.add_argument('-o', dest='out_file', metavar='FILE',
+        help='write the updated table here instead of over ipasndat_file')
+    parser.add_argument('--bin', dest='bin_file', metavar='FILE',
+        help='also write the table in the mmap-able binary format (see ipasndat.py)')
+    parser.add_argument('--decompress', default='builtin', metavar='MODE',
+        help='how to decompress the update files, as in convert_rib.py')
+    args = parser.parse_args()
+
+    st = time.time()
+    peer_ip = ipasndat.ip_to_int(args.peer) if args.peer else None
+
+    dat = dict(((start, mask), asn) for start, mask, asn in asnlookup.read_text(args.ipasndat_file))
+    table = UpdateTable(dat, authoritative=peer_ip is not None)
+    print 'Loaded %s (%d CIDRs)' % (args.ipasndat_file, len(table.dat))
+
+    for update_file in args.update_files:
+        f = rib_input.open_dump(update_file, args.decompress)
+        nn = table.apply(f, peer_ip)
+        f.close()
+        print 'Applied %s (%d updates)' % (update_file, nn)
+
+    print 'Prefixes announced: %d, withdrawn: %d in %.1fs' % (table.announced, table.withdrawn, time.time()-st)
+
+    out_file = args.out_file or args.ipasndat_file
+    entries = table.entries()
+    convert_rib.write_ipasndat(out_file, ' '.join([args.ipasndat_file] + args.update_files), entries)
+    print 'IPASNDAT file saved (%d CIDRs)' % len(entries)
+
+    if args.bin_file:
+        n = ipasndat.write_bin(args.bin_file, entries)
+        print 'IPASNBIN file saved (%d CIDRs)' % n
+
+
+if __name__ == '__main__':
+    main()
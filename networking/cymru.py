@@ -1,9 +1,18 @@
 ## API documentation can be found at http://www.team-cymru.org/Services/ip-to-asn.html
 
 from dns.exception import DNSException
+import array
+import bisect
+import collections
 import dns.resolver
+import os
+import Queue
 import re
 import socket
+import struct
+import sys
+import threading
+import time
 
 origin_asn_zone = 'origin.asn.cymru.com'
 desc_asn_zone = 'asn.cymru.com'
@@ -11,13 +20,145 @@ whois_server = 'whois.cymru.com'
 whois_port = 43
 fullbogons_dns = 'v4.fullbogons.cymru.com'
 
+## One resolver for every DNS lookup; it is safe to share between threads
+resolver = None
+
+## AS names by ASN, kept until their DNS TTL runs out: {asn: (name, expiration)}.
+## Shared by all threads; only one lookup per ASN is in flight at a time, see
+## asn_names_pending.
+asn_names = {}
+
+## Lookups in flight, {asn: [Event, exception or None]}: threads missing the
+## same ASN wait for the Event of the first one and share its result.
+asn_names_pending = {}
+asn_names_lock = threading.Lock()
+
+
+def get_resolver():
+	global resolver
+	if resolver is None:
+		resolver = dns.resolver.Resolver()
+	return resolver
+
+
+def ip_to_int(ip):
+	try:
+		return struct.unpack('>I', socket.inet_pton(socket.AF_INET, ip))[0]
+	except (socket.error, TypeError):
+		return None
+
+
+def same_ip(a, b):
+	if a == b: return True
+	n = ip_to_int(a)
+	return n is not None and n == ip_to_int(b)
+
+
+## Longest-prefix-match cache of lookup results, keyed on the BGP prefix each
+## answer comes with, so any later IP inside that prefix is answered without a
+## query. An IP inside a more specific prefix that is not cached yet gets the
+## covering prefix's answer, the price of not asking. Entries expire after ttl
+## seconds; answers without a prefix (no route) are cached for their IP alone,
+## as a /32, for negative_ttl.
+## At most max_entries prefixes are kept, the least recently used are dropped.
+class PrefixCache:
+
+	def __init__(self, max_entries=100000, ttl=3600, negative_ttl=300):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.lock = threading.Lock()
+		self.clear()
+
+	def clear(self):
+		with self.lock:
+			## (network, length) -> (expiration, [[prefix, asn, name], ...])
+			self.entries = collections.OrderedDict()
+			self.lengths = {}  ## length -> number of entries
+			self.order = []    ## the lengths present, longest first
+			self.hits = self.misses = 0
+
+	## The cached rows for ip as [ip, prefix, asn, name] lists, as the lookup
+	## returned them, or None if ip has to be looked up
+	def get(self, ip):
+		n = ip_to_int(ip)
+		if n is None: return None
+		now = time.time()
+
+		with self.lock:
+			for length in self.order:
+				key = (n & (0xffffffff << (32 - length)) & 0xffffffff, length)
+				entry = self.entries.get(key)
+				if entry is None: continue
+
+				del self.entries[key]
+				if entry[0] <= now:
+					self._count(length, -1)
+					continue
+				self.entries[key] = entry  ## most recently used
+				self.hits += 1
+				return [[ip] + row for row in entry[1]]
+
+			self.misses += 1
+			return None
+
+	## Caches the rows of a lookup of ip, as returned by the get_asn_data_*
+	## functions; no rows, or rows without a prefix, are a negative answer
+	def add(self, ip, rows):
+		prefix = rows and rows[0][1]
+		key = None
+		if prefix:
+			try:
+				net, length = prefix.split('/')
+				length = int(length)
+				key = (ip_to_int(net), length)
+			except ValueError:
+				pass
+
+		ttl = self.ttl
+		if key is None or key[0] is None or not 0 <= length <= 32:
+			n = ip_to_int(ip)
+			if n is None: return
+			key = (n, 32)
+			ttl = self.negative_ttl
+
+		entry = (time.time() + ttl, [list(row[1:]) for row in rows])
+
+		with self.lock:
+			if key in self.entries:
+				del self.entries[key]
+			else:
+				self._count(key[1], 1)
+			self.entries[key] = entry
+
+			while len(self.entries) > self.max_entries:
+				old, _ = self.entries.popitem(last=False)
+				self._count(old[1], -1)
+
+	def _count(self, length, d):
+		n = self.lengths.get(length, 0) + d
+		if n: self.lengths[length] = n
+		else: del self.lengths[length]
+
+		if n == d or not n:  ## a prefix length appeared or went away
+			self.order = sorted(self.lengths, reverse=True)
+
+	def __len__(self):
+		return len(self.entries)
+
+
+## A cache shared by the callers that pass it as the cache argument of the
+## lookup functions; they only cache when given one, as a cached answer may be
+## a covering prefix's
+prefix_cache = PrefixCache()
+
+
 ## Determine if IP is in the bogons list and return the prefix
 def get_bogon_by_dns(ip, source_ip=None):
 	try:
 		subject = "%s.%s" % ('.'.join(reversed(ip.split('.'))), fullbogons_dns)
 
-		resolver = dns.resolver.Resolver()
-		dns_answer = resolver.query(subject, rdtype=16, source=source_ip)
+		dns_answer = get_resolver().query(subject, rdtype=16, source=source_ip)
 		return ''.join([str(a) for a in dns_answer]).strip('"')
 
 	except dns.resolver.NXDOMAIN:
@@ -32,13 +173,129 @@ def get_bogon_by_dns(ip, source_ip=None):
 		raise Exception("%s: %s" % (e.__class__.__name__, error))
 
 
-## Get ASN data by using the DNS API
-def get_asn_data_by_dns(ip, source_ip=None):
+## The fullbogons list, from a local copy of
+## https://www.team-cymru.org/Services/Bogons/fullbogons-ipv4.txt (one CIDR per
+## line, # comments), as sorted start and end addresses for bisection. A prefix
+## inside another one is dropped, lookups report the covering prefix as the
+## DNS zone does; host bits set past the prefix length are ignored. The file
+## is checked for changes every check_every seconds at most; a new list is
+## built aside and swapped in with one assignment, so lookups in other threads
+## see either the old or the new list.
+class BogonSet:
+
+	def __init__(self, path, check_every=60):
+		self.path = path
+		self.check_every = check_every
+		self.mtime = None
+		self.checked = 0
+		self.table = None
+		self.reload()
+
+	## Loads the file again if it changed (or if force); returns True if it did
+	def reload(self, force=False):
+		self.checked = time.time()
+		mtime = os.path.getmtime(self.path)
+		if not force and mtime == self.mtime:
+			return False
+
+		prefixes = []
+		for line in open(self.path):
+			line = line.split('#')[0].strip()
+			if not line or ':' in line: continue  ## IPv6 lists are not used here
+
+			net, _, length = line.partition('/')
+			start = ip_to_int(net)
+			length = int(length) if length else 32
+			if start is None or not 0 <= length <= 32:
+				raise Exception("Bad prefix in %s: %s" % (self.path, line))
+			start &= ~((1 << (32 - length)) - 1) & 0xffffffff
+			prefixes.append((start, start + (1 << (32 - length)) - 1, line))
+		## widest first among prefixes with the same start, so it is the one kept
+		prefixes.sort(key=lambda r: (r[0], -r[1]))
+
+		starts, ends, names = array.array('I'), array.array('I'), []
+		for start, end, name in prefixes:
+			if ends and start <= ends[-1]: continue
+			starts.append(start)
+			ends.append(end)
+			names.append(name)
+
+		self.table = (starts, ends, names)
+		self.mtime = mtime
+		return True
+
+	def check(self):
+		if time.time() - self.checked >= self.check_every:
+			try:
+				self.reload()
+			except Exception:
+				pass  ## keep the old list, the next check tries again
+
+	## The bogon prefix covering ip, or None
+	def get(self, ip):
+		self.check()
+		starts, ends, names = self.table
+		n = ip_to_int(ip)
+		if n is None: return None
+		i = bisect.bisect_right(starts, n) - 1
+		if i >= 0 and n <= ends[i]: return names[i]
+		return None
+
+	## get() for many IPs at once: a list of the bogon prefix or None for each.
+	## The IPs are looked up in sorted order in one merge pass over the list,
+	## each bisection starting where the previous IP's ended
+	def get_many(self, ips):
+		self.check()
+		starts, ends, names = self.table
+		ret = [None] * len(ips)
+
+		keyed = []
+		for i, ip in enumerate(ips):
+			n = ip_to_int(ip)
+			if n is not None: keyed.append((n, i))
+		keyed.sort()
+
+		j, count = 0, len(starts)
+		for n, i in keyed:
+			j = bisect.bisect_left(ends, n, j)
+			if j == count: break
+			if starts[j] <= n: ret[i] = names[j]
+
+		return ret
+
+	def __len__(self):
+		return len(self.table[0])
+
+
+## The local fullbogons list get_bogon uses, see load_bogons
+bogons = None
+
+
+## Answer bogon checks from a local fullbogons file instead of DNS
+def load_bogons(path, check_every=60):
+	global bogons
+	bogons = BogonSet(path, check_every)
+	return bogons
+
+
+## Determine if IP is in the bogons list and return the prefix, from the
+## local list if one is loaded, else by DNS
+def get_bogon(ip, source_ip=None):
+	if bogons is not None: return bogons.get(ip)
+	return get_bogon_by_dns(ip, source_ip)
+
+
+## Get ASN data by using the DNS API; cache: a PrefixCache (such as
+## prefix_cache) to answer from and fill, or None
+def get_asn_data_by_dns(ip, source_ip=None, cache=None):
+	if cache is not None:
+		ret = cache.get(ip)
+		if ret is not None: return ret
+
 	try:
 		subject = "%s.%s" % ('.'.join(reversed(ip.split('.'))), origin_asn_zone)
 
-		resolver = dns.resolver.Resolver()
-		dns_answer = resolver.query(subject, rdtype=16, source=source_ip)
+		dns_answer = get_resolver().query(subject, rdtype=16, source=source_ip)
 		answer = ''.join([str(a) for a in dns_answer])
 
 		asn_str, prefix = [a.strip("\" ") for a in answer.split('|')][:2]
@@ -46,15 +303,13 @@ def get_asn_data_by_dns(ip, source_ip=None):
 		ret = []
 
 		for asn in asns:
-			subject = "AS%s.%s" % (asn, desc_asn_zone)
-			dns_answer = resolver.query(subject, rdtype=16, source=source_ip)
-			answer = ''.join([str(a) for a in dns_answer])
-			name = [a.strip("\" ") for a in answer.split('|')][-1]
-			ret.append([ip, prefix, asn, name])
+			ret.append([ip, prefix, asn, get_asn_name_by_dns(asn, source_ip)])
 
+		if cache is not None: cache.add(ip, ret)
 		return ret
 
 	except dns.resolver.NXDOMAIN:
+		if cache is not None: cache.add(ip, [])
 		return [] 
 
 	except DNSException, e:
@@ -66,12 +321,133 @@ def get_asn_data_by_dns(ip, source_ip=None):
 		raise Exception("%s: %s" % (e.__class__.__name__, error))
 
 
-## Get ASN data by using the whois API
-def get_asn_data_by_whois(ip):
+## Get the AS name of asn by using the DNS API, from asn_names while its TTL lasts.
+## Concurrent misses on the same ASN make one query. DNS errors are raised as
+## they are, for get_asn_data_by_dns to handle
+def get_asn_name_by_dns(asn, source_ip=None):
+	cached = asn_names.get(asn)
+	if cached is not None and cached[1] > time.time():
+		return cached[0]
+
+	asn_names_lock.acquire()
+	try:
+		## the lookup may have finished since the check above
+		cached = asn_names.get(asn)
+		if cached is not None and cached[1] > time.time():
+			return cached[0]
+		pending = asn_names_pending.get(asn)
+		first = pending is None
+		if first:
+			pending = asn_names_pending[asn] = [threading.Event(), None]
+	finally:
+		asn_names_lock.release()
+
+	if not first:
+		pending[0].wait()
+		if pending[1] is not None:
+			raise pending[1]
+		return asn_names[asn][0]
+
+	try:
+		subject = "AS%s.%s" % (asn, desc_asn_zone)
+		dns_answer = get_resolver().query(subject, rdtype=16, source=source_ip)
+		answer = ''.join([str(a) for a in dns_answer])
+		name = [a.strip("\" ") for a in answer.split('|')][-1]
+		asn_names[asn] = (name, dns_answer.expiration)
+		return name
+
+	except Exception, e:
+		pending[1] = e
+		raise
+
+	finally:
+		asn_names_lock.acquire()
+		del asn_names_pending[asn]
+		asn_names_lock.release()
+		pending[0].set()
+
+
+## Get ASN data for many IPs by using the DNS API, with up to workers lookups
+## in flight at once. Generator yielding [ip, data] in the order of ips, where
+## data is what get_asn_data_by_dns returns for ip, or the Exception it raised.
+## An exception raised by the ips iterable itself is raised again here, after
+## the results for the IPs before it.
+## The AS names come from the shared asn_names cache, so a batch needs about
+## one name lookup per distinct ASN.
+def get_asn_data_by_dns_bulk(ips, source_ip=None, workers=16, cache=None):
+	tasks = Queue.Queue(workers * 4)
+	results = Queue.Queue()
+	stop = threading.Event()
+	feed_error = []
+
+	def feed():
+		try:
+			for task in enumerate(ips):
+				while not stop.is_set():
+					try:
+						tasks.put(task, timeout=1)
+						break
+					except Queue.Full:
+						pass
+				if stop.is_set(): break
+		except Exception:
+			feed_error.append(sys.exc_info())
+		finally:
+			for i in range(workers):
+				tasks.put(None)
+
+	def work():
+		while True:
+			task = tasks.get()
+			if task is None: break
+			if stop.is_set(): continue
+			n, ip = task
+			try:
+				data = get_asn_data_by_dns(ip, source_ip, cache)
+			except Exception, e:
+				data = e
+			results.put((n, ip, data))
+		results.put(None)
+
+	threads = [threading.Thread(target=feed)] + [threading.Thread(target=work) for i in range(workers)]
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	try:
+		## Results arrive out of order; hold them until their turn
+		pending = {}
+		next_n = 0
+		running = workers
+
+		while running:
+			r = results.get()
+			if r is None:
+				running -= 1
+				continue
+
+			pending[r[0]] = r[1:]
+			while next_n in pending:
+				yield list(pending.pop(next_n))
+				next_n += 1
+
+		if feed_error:
+			raise feed_error[0][0], feed_error[0][1], feed_error[0][2]
+
+	finally:
+		stop.set()
+
+
+## Get ASN data by using the whois API; cache as for get_asn_data_by_dns
+def get_asn_data_by_whois(ip, server=whois_server, port=whois_port, cache=None):
+	if cache is not None:
+		ret = cache.get(ip)
+		if ret is not None: return ret
+
 	try:
 		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		s.connect((whois_server, whois_port))
-		s.send("%s\n" % ip)
+		s.connect((server, port))
+		s.send("-p %s\n" % ip)
 		response = ''
 
 		while True:
@@ -86,10 +462,13 @@ def get_asn_data_by_whois(ip):
 		ret = []
 
 		for i in nl_split:
-			asn, ip, name = [a.strip() for a in i.split('|')]
-			if asn == 'NA': asn = 0
-			ret.append([ip, '', asn, name])
+			asn, ip, prefix, name = [a.strip() for a in i.split('|')]
+			if asn == 'NA':
+				asn = 0
+				prefix = ''
+			ret.append([ip, prefix, asn, name])
 
+		if cache is not None: cache.add(ip, ret)
 		return ret
 
 	except Exception, e:
@@ -97,3 +476,108 @@ def get_asn_data_by_whois(ip):
 		if not error: error = e.__doc__
 		raise Exception("%s: %s" % (e.__class__.__name__, error))
 
+
+## Get ASN data for many IPs over one whois connection, using the bulk
+## protocol (begin / verbose / one IP per line / end). Generator yielding
+## [ip, prefix, asn, name] rows in the order of ips, as the answers arrive; an
+## IP gets one row per origin ASN (more than one for MOAS prefixes), IPs the
+## server cannot parse get none. Response lines are matched to the IPs sent
+## by their IP column. IPs found in cache (as for get_asn_data_by_dns) are
+## answered from it and not sent. The IPs are sent from a separate thread
+## while the responses are read, so neither side blocks on a full socket
+## buffer. server and port can point at a local stand-in such as
+## bgp/asnserver.py.
+def get_asn_data_by_whois_bulk(ips, server=whois_server, port=whois_port, timeout=60, cache=None):
+	try:
+		s = socket.create_connection((server, port), timeout)
+		send_error = []
+
+		## What to yield next, in the order of ips: ('rows', cached rows)
+		## or ('ip', ip) for the response lines of an IP sent; False at the end
+		order = Queue.Queue()
+
+		def send():
+			try:
+				s.sendall("begin\nverbose\n")
+				batch = []
+				for ip in ips:
+					rows = cache.get(ip) if cache is not None else None
+					if rows is not None:
+						order.put(('rows', rows))
+						continue
+
+					batch.append("%s\n" % ip)
+					order.put(('ip', ip))
+					if len(batch) == 1000:
+						s.sendall(''.join(batch))
+						batch = []
+				batch.append("end\n")
+				s.sendall(''.join(batch))
+			except Exception, e:
+				send_error.append(e)
+				try: s.shutdown(socket.SHUT_RDWR)
+				except socket.error: pass
+			finally:
+				order.put(False)
+
+		sender = threading.Thread(target=send)
+		sender.daemon = True
+		sender.start()
+
+		try:
+			f = s.makefile('r')
+			line = None  ## read but not yet matched to an IP
+
+			while True:
+				item = order.get()
+				if item is False: break
+				(kind, x) = item
+				if kind == 'rows':
+					for row in x: yield row
+					continue
+
+				## The lines of this IP: all consecutive lines with its IP
+				## column, or a single error line
+				rows = []
+				while True:
+					if line is None:
+						line = f.readline()
+						while line.startswith('Bulk mode;'):
+							line = f.readline()
+					if not line: break
+
+					if line.startswith('Error:'):
+						if not rows: line = None
+						break
+
+					fields = [a.strip() for a in line.split('|')]
+					if len(fields) < 7:
+						line = None
+						continue
+
+					asn, ip, prefix, name = fields[0], fields[1], fields[2], fields[6]
+					if not same_ip(ip, x.strip()): break  ## the next IP's line
+					line = None
+
+					if asn == 'NA':
+						asn = 0
+						prefix = ''
+					rows.append([ip, prefix, asn, name])
+
+				if rows and cache is not None: cache.add(x, rows)
+				for row in rows: yield row
+
+			sender.join()
+			if send_error: raise send_error[0]
+
+		finally:
+			## Also stops the sender when the caller stops early
+			try: s.shutdown(socket.SHUT_RDWR)
+			except socket.error: pass
+			s.close()
+			sender.join()
+
+	except Exception, e:
+		error = str(e)
+		if not error: error = e.__doc__
+		raise Exception("%s: %s" % (e.__class__.__name__, error))
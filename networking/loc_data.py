@@ -22,6 +22,13 @@ python script.py --field IP --field Hostname --field NS --quote-none 1.2.3.4
 
 cat domains.txt | python script.py --field Input --field IP --quote-none
 
+Subjects are looked up concurrently (--workers, 10 by default), with optional
+per-stage limits (--dns-workers, --whois-workers, --web-workers,
+--ping-workers). Rows are written in input order, or as each subject finishes
+with --unordered.
+
+cat domains.txt | python script.py --workers 50 --whois-workers 5 --unordered
+
 -------------------------------------------------------------------------------
 | OUTPUT
 -------------------------------------------------------------------------------
@@ -97,12 +104,14 @@ import dns.resolver
 import dns.reversename
 import itertools
 import json
+import Queue
 import re
 import requests
 import signal
 import socket
 import subprocess
 import sys
+import threading
 import urllib2
 
 
@@ -208,16 +217,21 @@ def get_pwhois(ip):
     return whois
 
 
-## DNS query
+## Signals can only be handled in the main thread
+main_thread = threading.current_thread()
+
+## DNS query; worker threads cannot use the alarm and rely on the resolver's
+## lifetime instead
 def dns_query(resolver, subject, qtype):
     alarm = Alarm()
+    use_alarm = threading.current_thread() is main_thread
     answers = []
 
     if qtype == "PTR":
         subject = dns.reversename.from_address(subject)
 
     try:
-        alarm.set(dns_resolver.timeout)
+        if use_alarm: alarm.set(resolver.timeout)
         dns_answer = resolver.query(subject, qtype, raise_on_no_answer=False)
 
         if (dns_answer.response.flags & dns.flags.TC) == dns.flags.TC:
@@ -227,7 +241,7 @@ def dns_query(resolver, subject, qtype):
         dns_answer = None
 
     finally:
-        alarm.clear()
+        if use_alarm: alarm.clear()
 
     try:
         ## Some DNS servers return NXDOMAIN as part of TXT
@@ -244,6 +258,196 @@ def is_ip(ip=""):
     return re.match("^(?:\d+\.){3}\d+$", ip)
 
 
+## Stages that wait on the network, each with its own concurrency limit
+STAGES = ["dns", "whois", "web", "ping"]
+
+
+## Run func on every item in up to workers threads. Yields the results in the
+## order of items, or in the order they finish if not ordered. An exception
+## in func is raised here.
+def run_pool(items, func, workers, ordered=True):
+    tasks = Queue.Queue(workers * 2)
+    results = Queue.Queue()
+
+    def feed():
+        for task in enumerate(items):
+            tasks.put(task)
+        for i in range(workers):
+            tasks.put(None)
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None: break
+
+            (n, item) = task
+            try:
+                results.put((n, func(item), None))
+            except Exception, e:
+                results.put((n, None, e))
+        results.put(None)
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend(threading.Thread(target=work) for i in range(workers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    pending = {}
+    next_n = 0
+    running = workers
+
+    while running:
+        ## With a timeout so Ctrl-C still works while waiting
+        try:
+            r = results.get(True, 1)
+        except Queue.Empty:
+            continue
+
+        if r is None:
+            running -= 1
+            continue
+
+        (n, result, e) = r
+        if e is not None: raise e
+
+        if not ordered:
+            yield result
+            continue
+
+        pending[n] = result
+        while next_n in pending:
+            yield pending.pop(next_n)
+            next_n += 1
+
+
+## Is IP ICMP reachable? "Y", "N", or "" if ping could not run
+def ping(ip):
+    try:
+        p1 = subprocess.Popen(
+                ["ping", "-n", "-c", "1", "-W", "1", "-q", ip],
+                stdout=subprocess.PIPE
+        )
+
+        p2 = subprocess.Popen(
+                ["grep", "100% packet loss"],
+                stdin=p1.stdout,
+                stdout=subprocess.PIPE
+        )
+
+        p1.stdout.close()
+
+        output = p2.communicate()[0]
+
+        if len(output) == 0:
+            return "Y"
+        else:
+            return "N"
+
+    except:
+        return ""
+
+
+## All lookups for one input subject; returns one dict of CSV fields per IP
+## found. Each stage holds its semaphore in limits while it waits on the
+## network.
+def enrich(subject, args, resolver, limits):
+    (scheme, path) = ("", "")
+    original_subject = subject
+    subject_type = "DOMAIN"
+    rows = []
+
+    ## Check for scheme, save it, and remove it from subject
+    m = re.match("^h...s?://", subject)
+    if m is not None:
+        scheme = m.group(0)
+        subject = re.sub(scheme, "", subject)
+        scheme = re.sub("h..p", "http", scheme)
+
+    ## Check for path, save it, and remove it from subject
+    m = re.search("/.*$", subject)
+    if m is not None:
+        path = m.group(0)
+        subject = re.sub(path, "", subject)
+        subject_type = "URL"
+
+        ## Save a default scheme if not present
+        if len(scheme) == 0:
+            scheme = "http://"
+
+    ## What's left?
+    if is_ip(subject):
+        subject_type = "IP"
+
+
+    ## Get hostname, IPs, and CNAMEs
+    try:
+        with limits["dns"]:
+            if subject_type == "IP":
+                ips = [subject]
+                hostname = dns_query(resolver, subject, "PTR")[0]
+
+            else:
+                hostname = subject
+                ips = dns_query(resolver, subject, "A")
+
+            cnames = dns_query(resolver, hostname, "CNAME")
+            nameservers = dns_query(resolver, hostname, "NS")
+
+    except Exception:
+        ## Something went wrong, go with the basics
+        cnames = []
+        nameservers = []
+
+        if subject_type == "IP":
+            ips = [subject]
+            hostname = ""
+
+        else:
+            ips = []
+            hostname = subject
+
+    ## Process all IPs we have
+    for ip in ips:
+        with limits["whois"]:
+            w = get_pwhois(ip)
+        [w.setdefault(k, "") for k in data_keys]
+
+        #if len(w["Error"]) > 0:
+            ## Happens when we exceed our daily query limit; give all
+            ## default fields empty string values.
+        #    [w.setdefault(k, "") for k in data_keys]
+
+        w["IP"] = ip
+        w["Input"] = original_subject
+        w["Scheme"] = scheme
+        w["URL-Path"] = path
+        w["Hostname"] = hostname
+        w["CNAMES"] = args.value_sep.join(cnames)
+        w["NS"] = args.value_sep.join(nameservers)
+        w["Web"] = ""
+        w["Ping"] = ""
+
+        ## Quick and dirty web test
+        if args.web is True and len(scheme) > 0:
+            try:
+                with limits["web"]:
+                    r = requests.head("{0}{1}{2}".format(scheme, subject, path))
+                w["Web"] = r.status_code
+            except:
+                pass
+
+
+        ## Is IP ICMP reachable?
+        if args.ping is True and len(w["IP"]) > 0:
+            with limits["ping"]:
+                w["Ping"] = ping(w["IP"])
+
+        rows.append(w)
+
+    return rows
+
+
 ## Main
 if __name__ == "__main__":
     ## Output fields in the order we want them to appear
@@ -352,6 +556,33 @@ if __name__ == "__main__":
         help="DNS server to use for queries; can use multiple times"
     )
 
+    ## Subjects looked up at the same time
+    arg_parser.add_argument(
+        "--workers",
+        default=10,
+        type=int,
+        metavar="N",
+        help="number of subjects to look up at once"
+    )
+
+    ## Per-stage limits within --workers
+    for stage in STAGES:
+        arg_parser.add_argument(
+            "--{0}-workers".format(stage),
+            default=0,
+            type=int,
+            metavar="N",
+            help="at most N {0} lookups at once (default: --workers)".format(stage)
+        )
+
+    ## Write rows as they finish instead of in input order
+    arg_parser.add_argument(
+        "--unordered",
+        action="store_true",
+        default=False,
+        help="write CSV rows as lookups finish, not in input order"
+    )
+
     ## The CSV fields to output; will be printed in order given
     arg_parser.add_argument(
         "--field",
@@ -415,6 +646,12 @@ if __name__ == "__main__":
     else:
         dns_resolver.timeout = args.dns_timeout
 
+    ## The whole query, for worker threads that cannot use the alarm
+    dns_resolver.lifetime = dns_resolver.timeout
+
+    if args.workers <= 0:
+        args.workers = 1
+
     ## Set up our CSV writer
     csv_writer = csv.writer(sys.stdout, quoting=args.csv_quoting)
 
@@ -431,116 +668,21 @@ if __name__ == "__main__":
     if args.no_header == False and len(data) > 0:
         csv_writer.writerow(args.fields)
 
-    ## Check out what we got as input
-    for subject in data:
-        (scheme, path) = ("", "")
-        original_subject = subject
-        subject_type = "DOMAIN"
-
-        ## Check for scheme, save it, and remove it from subject
-        m = re.match("^h...s?://", subject)
-        if m is not None:
-            scheme = m.group(0)
-            subject = re.sub(scheme, "", subject)
-            scheme = re.sub("h..p", "http", scheme)
-
-        ## Check for path, save it, and remove it from subject
-        m = re.search("/.*$", subject)
-        if m is not None:
-            path = m.group(0)
-            subject = re.sub(path, "", subject)
-            subject_type = "URL"
-
-            ## Save a default scheme if not present
-            if len(scheme) == 0:
-                scheme = "http://"
-
-        ## What's left?
-        if is_ip(subject):
-            subject_type = "IP"
-
-
-        ## Get hostname, IPs, and CNAMEs
-        try:
-            if subject_type == "IP":
-                ips = [subject]
-                hostname = dns_query(dns_resolver, subject, "PTR")[0]
-
-            else:
-                hostname = subject
-                ips = dns_query(dns_resolver, subject, "A")
-
-            cnames = dns_query(dns_resolver, hostname, "CNAME")
-            nameservers = dns_query(dns_resolver, hostname, "NS")
-
-        except Exception, e:
-            ## Something went wrong, go with the basics
-            cnames = []
-            nameservers = []
-
-            if subject_type == "IP":
-                ips = [subject]
-                hostname = ""
-
-            else:
-                ips = []
-                hostname = subject
-
-        ## Process all IPs we have
-        for ip in ips:
-            w = get_pwhois(ip)
-            [w.setdefault(k, "") for k in data_keys]
-
-            #if len(w["Error"]) > 0:
-                ## Happens when we exceed our daily query limit; give all
-                ## default fields empty string values.
-            #    [w.setdefault(k, "") for k in data_keys]
-
-            w["IP"] = ip
-            w["Input"] = original_subject
-            w["Scheme"] = scheme
-            w["URL-Path"] = path
-            w["Hostname"] = hostname
-            w["CNAMES"] = args.value_sep.join(cnames)
-            w["NS"] = args.value_sep.join(nameservers)
-            w["Web"] = ""
-            w["Ping"] = ""
-
-            ## Quick and dirty web test
-            if args.web is True and len(scheme) > 0:
-                try:
-                    r = requests.head("{0}{1}{2}".format(scheme, subject, path))
-                    w["Web"] = r.status_code
-                except:
-                    pass
-
-
-            ## Is IP ICMP reachable?
-            if args.ping is True and len(w["IP"]) > 0:
-                try:
-                    p1 = subprocess.Popen(
-                            ["ping", "-n", "-c", "1", "-W", "1", "-q", w["IP"]],
-                            stdout=subprocess.PIPE
-                    )
-
-                    p2 = subprocess.Popen(
-                            ["grep", "100% packet loss"],
-                            stdin=p1.stdout,
-                            stdout=subprocess.PIPE
-                    )
-
-                    p1.stdout.close()
-
-                    output = p2.communicate()[0]
-
-                    if len(output) == 0:
-                        w["Ping"] = "Y"
-                    else:
-                        w["Ping"] = "N"
-
-                except:
-                    pass
+    ## Look up many subjects at once; rows are written in input order unless
+    ## --unordered, in which case each is written as soon as it is done
+    limits = dict(
+        (stage, threading.BoundedSemaphore(getattr(args, stage + "_workers") or args.workers))
+        for stage in STAGES
+    )
 
+    results = run_pool(
+        data,
+        lambda subject: enrich(subject, args, dns_resolver, limits),
+        args.workers,
+        ordered=not args.unordered
+    )
 
+    for rows in results:
+        for w in rows:
             csv_writer.writerow([w[k] for k in args.fields])
-
+        sys.stdout.flush()
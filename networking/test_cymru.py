@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+## Checks of the local fullbogons list (cymru.BogonSet). Needs dnspython,
+## as cymru.py does:  python test_cymru.py
+
+import os
+import tempfile
+import unittest
+
+import cymru
+
+
+class BogonSetTest(unittest.TestCase):
+
+	def bogons(self, *lines):
+		fd, path = tempfile.mkstemp()
+		os.write(fd, '\n'.join(lines) + '\n')
+		os.close(fd)
+		self.addCleanup(os.remove, path)
+		return cymru.BogonSet(path)
+
+	def check(self, b, expected):
+		ips = sorted(expected)
+		for ip in ips:
+			self.assertEqual(b.get(ip), expected[ip], ip)
+		self.assertEqual(b.get_many(ips), [expected[ip] for ip in ips])
+
+	def test_nested_same_start(self):
+		for lines in (['10.0.0.0/16', '10.0.0.0/8'], ['10.0.0.0/8', '10.0.0.0/16']):
+			b = self.bogons(*lines)
+			self.assertEqual(len(b), 1)
+			self.check(b, {'10.1.1.1': '10.0.0.0/8', '10.0.0.1': '10.0.0.0/8', '11.0.0.0': None})
+
+	def test_nested_inside(self):
+		b = self.bogons('# fullbogons', '192.168.1.0/24', '192.168.0.0/16', '192.168.1.128/25', '0.0.0.0/8')
+		self.assertEqual(len(b), 2)
+		self.check(b, {'192.168.1.200': '192.168.0.0/16', '192.168.255.255': '192.168.0.0/16',
+			'192.169.0.0': None, '0.1.2.3': '0.0.0.0/8', '1.0.0.0': None, 'not an ip': None})
+
+	def test_host_bits(self):
+		b = self.bogons('10.0.0.1/8', '172.16.5.5/12')
+		self.check(b, {'10.0.0.0': '10.0.0.1/8', '10.255.255.255': '10.0.0.1/8', '9.255.255.255': None,
+			'172.31.0.1': '172.16.5.5/12', '172.32.0.0': None})
+
+	def test_adjacent_and_duplicate(self):
+		b = self.bogons('100.64.0.0/10', '100.128.0.0/9', '100.64.0.0/10', '224.0.0.0/3')
+		self.assertEqual(len(b), 3)
+		self.check(b, {'100.127.255.255': '100.64.0.0/10', '100.128.0.0': '100.128.0.0/9',
+			'100.63.255.255': None, '255.255.255.255': '224.0.0.0/3'})
+
+
+if __name__ == '__main__':
+	unittest.main()